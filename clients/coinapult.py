@@ -4,20 +4,28 @@ Copyright Coinapult 2013, 2014
 """
 
 import os
+import re
+import sys
 import hmac
 import json
 import time
 import base64
+import bisect
+import random
+import threading
+import Queue
+from multiprocessing.pool import ThreadPool
 from urlparse import urljoin
+from collections import OrderedDict
+from contextlib import contextmanager
 from hashlib import sha256, sha512
 
 import requests
+from requests.adapters import HTTPAdapter
 
+# ecdsa is imported on first use by loadECDSA, so that programs using
+# only the HMAC authentication do not pay for it.
 ecdsa = None
-try:
-    import ecdsa
-except ImportError:
-    print "authentication through ECC not available"
 
 __version__ = "2.03"
 
@@ -28,17 +36,238 @@ MFYwEAYHKoZIzj0CAQYFK4EEAAoDQgAEWp9wd4EuLhIZNaoUgZxQztSjrbqgTT0w
 LBq8RwigNE6nOOXFEoGCjGfekugjrHWHUi8ms7bcfrowpaJKqMfZXg==
 -----END PUBLIC KEY-----
 """
+# Parsed from ECC_COINAPULT_PUB on first use, see coinapultPubkey.
 ECC_COINAPULT_PUBKEY = None
-if ecdsa:
-    ECC_COINAPULT_PUBKEY = ecdsa.VerifyingKey.from_pem(ECC_COINAPULT_PUB)
 ECC_CURVE = 'secp256k1'
 
+_eccLock = threading.Lock()
+# Other keys trusted by clients, by PEM, see coinapultPubkey.
+_eccServerKeys = {}
+
+
+def loadECDSA():
+    """
+    Import and return the ecdsa module.
+
+    :raises CoinapultErrorECC: if ecdsa is not installed
+    """
+    global ecdsa
+    if ecdsa is None:
+        try:
+            import ecdsa as module
+        except ImportError:
+            raise CoinapultErrorECC("authentication through ECC not "
+                                    "available, ecdsa is not installed")
+        ecdsa = module
+    return ecdsa
+
+
+def coinapultPubkey(pem=None):
+    """
+    Return the key used by Coinapult for signing its messages or, if
+    pem is specified, the parsed key it holds.
+    """
+    global ECC_COINAPULT_PUBKEY
+    if pem is not None:
+        pubkey = _eccServerKeys.get(pem)
+        if pubkey is None:
+            with _eccLock:
+                pubkey = _eccServerKeys.get(pem)
+                if pubkey is None:
+                    pubkey = precomputedKey(
+                        loadECDSA().VerifyingKey.from_pem(pem))
+                    _eccServerKeys[pem] = pubkey
+        return pubkey
+    if ECC_COINAPULT_PUBKEY is None:
+        with _eccLock:
+            if ECC_COINAPULT_PUBKEY is None:
+                pubkey = loadECDSA().VerifyingKey.from_pem(ECC_COINAPULT_PUB)
+                ECC_COINAPULT_PUBKEY = precomputedKey(pubkey)
+    return ECC_COINAPULT_PUBKEY
+
+
+def precomputedKey(pubkey):
+    """
+    Return a copy of the ecdsa.VerifyingKey pubkey with precomputed
+    point tables, which makes each verification with it about three
+    times faster. Keys are returned unchanged by ecdsa < 0.15.
+    """
+    if not hasattr(pubkey, 'precompute'):
+        return pubkey
+    ecdsa = loadECDSA()
+    # Points parsed from PEM do not carry the curve order, which the
+    # precomputation needs.
+    point = pubkey.pubkey.point
+    point = ecdsa.ellipticcurve.Point(point.curve(), point.x(), point.y(),
+                                      ecdsa.SECP256k1.order)
+    pubkey = ecdsa.VerifyingKey.from_public_point(point, curve=ecdsa.SECP256k1)
+    pubkey.precompute()
+    return pubkey
+
+
 TERMS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'TERMS.txt')
 
 
+class JSONCodec(object):
+    """
+    Pair of functions used for serializing request payloads (dumps)
+    and parsing responses (loads). Responses are parsed straight from
+    the bytes received, so loads must accept a str.
+
+    The payload is signed exactly as produced by dumps. The standard
+    json.dumps is used by default, which keeps the signed bytes the same
+    as in previous versions. Any other serializer produces different,
+    but equally valid, signatures.
+    """
+
+    def __init__(self, dumps=json.dumps, loads=json.loads):
+        self.dumps = dumps
+        self.loads = loads
+
+    @classmethod
+    def fastest(cls):
+        """
+        Return a codec parsing responses with ujson when it is
+        installed, and serializing with the standard json.dumps.
+        """
+        try:
+            import ujson
+        except ImportError:
+            return STDLIB_CODEC
+        return cls(loads=ujson.loads)
+
+
+STDLIB_CODEC = JSONCodec()
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_DECODER = json.JSONDecoder()
+# Characters that may follow a complete number.
+_DELIMITERS = frozenset(',]} \t\n\r')
+
+
+class _JSONReader(object):
+    """Read JSON tokens and values from an iterable of str chunks."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        if self.eof:
+            return False
+        for chunk in self.chunks:
+            if chunk:
+                self.buf = self.buf[self.pos:] + chunk
+                self.pos = 0
+                return True
+        self.eof = True
+        return False
+
+    def peek(self):
+        """Skip whitespace and return the next character, '' at the end."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise CoinapultError("malformed response from Coinapult")
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if self._fill():
+                    continue
+                raise CoinapultError("malformed response from Coinapult")
+            # A number only ends at a delimiter, otherwise it may
+            # continue in the next chunk, e.g. '450.' then '01'.
+            if (isinstance(value, (int, long, float)) and
+                    (end == len(self.buf) or
+                     self.buf[end] not in _DELIMITERS) and self._fill()):
+                continue
+            self.pos = end
+            return value
+
+
+def iterJSONArray(chunks, key='result', meta=None):
+    """
+    Incrementally parse a JSON object read from an iterable of str
+    chunks, yielding the items of the array under key as they are
+    complete. Other keys are stored in the dict meta, if given.
+
+    Memory use is bounded by the size of the largest item rather than
+    the size of the whole document.
+
+    :raises CoinapultError: if the object has an 'error' key
+    """
+    reader = _JSONReader(chunks)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        name = reader.value()
+        reader.expect(':')
+        if name == key and reader.peek() == '[':
+            reader.pos += 1
+            if reader.peek() == ']':
+                reader.pos += 1
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.expect(',]') == ']':
+                        break
+        else:
+            value = reader.value()
+            if name == 'error':
+                raise CoinapultError(value)
+            if meta is not None:
+                meta[name] = value
+        if reader.expect(',}') == '}':
+            break
+
+
+def createSession(poolConnections=10, poolMaxsize=10, poolBlock=False):
+    """
+    Create a keep-alive HTTP session suitable for talking to Coinapult.
+
+    :param int poolConnections: number of per-host connection pools
+        to keep around
+    :param int poolMaxsize: maximum number of connections kept open
+        to a single host
+    :param bool poolBlock: if True, wait for a free connection instead
+        of opening a new, non-pooled, one when poolMaxsize is reached
+    :rtype requests.Session:
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=poolConnections,
+                          pool_maxsize=poolMaxsize, pool_block=poolBlock)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
 class CoinapultClient():
+    # Bytes read at a time from streamed responses.
+    streamChunkSize = 65536
+
     def __init__(self, credentials=None, baseURL='https://api.coinapult.com',
-                 ecc=None, authmethod=None):
+                 ecc=None, authmethod=None, session=None, timeout=None,
+                 poolConnections=10, poolMaxsize=10, poolBlock=False,
+                 tickerCache=None, rateLimits=None, retry=None,
+                 coalesce=False, codec=None, coinapultPub=None,
+                 callTimeout=None, hedgeDelay=None):
         """
         Instantiate a Coinapult client for using the API at baseURL.
         If the parameter credentials is specified, it must contain the
@@ -55,21 +284,79 @@ class CoinapultClient():
         :param str authmethod: authentication method to use when
             sending signed requests, either 'ecc' or 'creds'
         :param str baseURL: base URL for the API server
+        :param requests.Session session: HTTP session used for every
+            request. If not specified, a pooled keep-alive session is
+            created (see createSession) and owned by this client. A
+            session passed in is never closed by the client
+        :param timeout: seconds to wait for the server, either a single
+            number or a (connect, read) tuple. None waits forever
+        :param int poolConnections: see createSession
+        :param int poolMaxsize: see createSession
+        :param bool poolBlock: see createSession
+        :param TickerCache tickerCache: if specified, getTicker results
+            are cached in it
+        :param dict rateLimits: maximum request rates per endpoint
+            prefix, as {prefix: (requests per second, burst)}, e.g.
+            {'/api/t/': (5, 10), '/api/ticker/': (2, 5)}. See RateLimiter
+        :param RetryPolicy retry: if specified, transient failures are
+            retried as described in RetryPolicy
+        :param bool coalesce: if True, identical read only requests
+            (accountInfo, accountAddress and getTicker) made while one
+            is already in flight wait for it and share its result
+            instead of being sent again
+        :param JSONCodec codec: serializer for request payloads and
+            parser for responses. Defaults to the standard json module
+        :param str coinapultPub: public key, in the PEM format, trusted
+            for the messages signed by the server instead of
+            ECC_COINAPULT_PUB, e.g. for testing against a local server
+        :param callTimeout: default deadline, in seconds, of every call
+            made outside of a deadline context. See deadline
+        :param hedgeDelay: if specified, a read only request (see
+            READ_ENDPOINTS) that did not complete after this many
+            seconds is sent a second time, from a pool of poolMaxsize
+            threads, while the first copy keeps waiting in a thread of
+            its own. The first response received is returned, whichever
+            copy it comes from. Requests that move money are never
+            hedged
         """
         self.key = ''
         self.secret = ''
         self.ecc = None
         self.ecc_pub_pem = None
+        self.ecc_pub_hash = None
+        # PEM keypair, parsed by _loadECC when first needed.
+        self._eccPEM = None
+        self._eccLock = threading.Lock()
         self.authmethod = authmethod
 
         if credentials:
             self.key = str(credentials['key'])
             self.secret = str(credentials['secret'])
         self.baseURL = baseURL
-        if ecc and ecdsa:
-            self._setupECCPair((ecc['privkey'], ecc['pubkey']))
+        self.timeout = timeout
+        self._ownSession = session is None
+        if session is None:
+            session = createSession(poolConnections, poolMaxsize, poolBlock)
+        self.session = session
+        self.tickerCache = tickerCache
+        self.rateLimiter = RateLimiter(rateLimits) if rateLimits else None
+        self.retry = retry
+        self._singleFlight = SingleFlight() if coalesce else None
+        self.codec = codec or STDLIB_CODEC
+        self.coinapultPub = coinapultPub
+        self.callTimeout = callTimeout
+        self.hedgeDelay = hedgeDelay
+        self._hedgeWorkers = poolMaxsize
+        self._hedgePool = None
+        self._hedgeLock = threading.Lock()
+        self._local = threading.local()
+        self.signingPool = None
+        self._hooks = []
+        if ecc:
+            self._eccPEM = (ecc['privkey'], ecc['pubkey'])
 
     def _setupECCPair(self, keypair=None):
+        ecdsa = loadECDSA()
         if not keypair:
             privkey = ecdsa.SigningKey.generate(curve=ecdsa.SECP256k1)
             pubkey = privkey.get_verifying_key()
@@ -84,42 +371,177 @@ class CoinapultClient():
             raise TypeError("Curve must be %s" % ECC_CURVE)
         self.ecc_pub_pem = self.ecc['pubkey'].to_pem().strip()
         self.ecc_pub_hash = sha256(self.ecc_pub_pem).hexdigest()
+        self._eccPEM = None
+        if self.signingPool is not None:
+            # Signing with the previous key.
+            self.signingPool.close()
+            self.signingPool = None
 
-    def _sendRequest(self, url, values, sign=False, post=True):
+    def _loadECC(self):
+        """
+        Parse the ECC keypair given to the constructor, if not done yet,
+        and return self.ecc.
+        """
+        if self._eccPEM is not None:
+            with self._eccLock:
+                if self._eccPEM is not None:
+                    self._setupECCPair(self._eccPEM)
+        return self.ecc
+
+    def close(self):
+        """Release the pooled connections held by this client."""
+        if self._hedgePool is not None:
+            self._hedgePool.terminate()
+            self._hedgePool = None
+        if self.signingPool is not None:
+            self.signingPool.close()
+            self.signingPool = None
+        if self._ownSession and self.session is not None:
+            self.session.close()
+        self.session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @contextmanager
+    def deadline(self, seconds):
+        """
+        Return a context manager limiting the time taken by the calls
+        made in it, from the current thread, to seconds in total. The
+        limit covers waiting for the rate limiter, signing, connecting
+        and reading, as well as retries. A nested deadline can only
+        shorten the enclosing one. The time left is the timeout of
+        each connect and socket read, so a response that keeps
+        arriving slowly may still end after the deadline.
+
+        When it expires, CoinapultDeadlineError is raised. Its sent
+        attribute tells whether the request may have been processed.
+        A response received in time is always returned.
+
+            with client.deadline(2):
+                ticker = client.getTicker()
+        """
+        previous = getattr(self._local, 'deadline', None)
+        deadline = time.time() + seconds
+        if previous is not None:
+            deadline = min(previous, deadline)
+        self._local.deadline = deadline
+        try:
+            yield
+        finally:
+            self._local.deadline = previous
+
+    def _remaining(self, sent=False):
+        """
+        Return the seconds left before the current deadline, or None.
+
+        :raises CoinapultDeadlineError: if it expired
+        """
+        deadline = getattr(self._local, 'deadline', None)
+        if deadline is None:
+            return None
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise CoinapultDeadlineError("deadline exceeded", sent=sent)
+        return remaining
+
+    def _timeout(self):
+        """
+        Return the timeout for the next HTTP request, shortened to the
+        time left before the deadline, and whether it was shortened.
+        """
+        remaining = self._remaining()
+        if remaining is None:
+            return self.timeout, False
+        if self.timeout is None:
+            return remaining, True
+        if isinstance(self.timeout, tuple):
+            timeout = tuple(remaining if item is None else min(item, remaining)
+                            for item in self.timeout)
+            return timeout, timeout != self.timeout
+        return min(self.timeout, remaining), remaining < self.timeout
+
+    def _runWithDeadline(self, deadline, func, *args, **kwargs):
+        """Call func in the current thread under the given deadline."""
+        previous = getattr(self._local, 'deadline', None)
+        self._local.deadline = deadline
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._local.deadline = previous
+
+    def _http(self, url, data, headers=None, post=True, stream=False):
+        """Perform the actual HTTP request through self.session."""
+        if self.session is None:
+            raise CoinapultError("client is closed")
+        finalURL = urljoin(self.baseURL, url)
+        timeout, limited = self._timeout()
+        try:
+            if post:
+                res = self.session.post(finalURL, data=data, headers=headers,
+                                        timeout=timeout, stream=stream)
+            else:
+                res = self.session.get(finalURL, params=data, timeout=timeout,
+                                       stream=stream)
+        except requests.Timeout, err:
+            if not limited:
+                raise
+            raise CoinapultDeadlineError(
+                "deadline exceeded waiting for Coinapult",
+                sent=not isinstance(err, requests.ConnectTimeout))
+        if res.status_code in TRANSIENT_STATUS:
+            raise CoinapultTransientError(
+                "HTTP %d from Coinapult" % res.status_code,
+                sent=res.status_code not in (429, 503),
+                retryAfter=res.headers.get('retry-after'))
+        return res
+
+    def _sendRequest(self, url, values, sign=False, post=True, trace=None):
         """
         Send message to URL and return response contents.
         This method supports authentication through the traditional method.
+        If trace is a dict, the duration of each phase is stored in it.
 
         Raises CoinapultError
         """
-        headers = {}
-
+        timer = _NULL_TIMER if trace is None else _PhaseTimer(trace)
         if sign:
-            values['timestamp'] = int(time.time())
-            values['nonce'] = createNonce(20)
-            values['endpoint'] = url[4:] if url.startswith('/api') else url
-            headers['cpt-key'] = self.key
-            signdata = base64.b64encode(json.dumps(values))
-            headers['cpt-hmac'] = generateHmac(signdata, self.secret)
-            data = {'data': signdata}
+            data, headers = self._signRequest(url, values)
         else:
-            data = values
+            data, headers = values, {}
+        timer.lap('sign')
 
-        finalURL = urljoin(self.baseURL, url)
-        if post:
-            res = requests.post(finalURL, data=data, headers=headers)
-        else:
-            res = requests.get(finalURL, params=data)
-        return self._format_response(res.text)
+        res = self._http(url, data, headers, post)
+        timer.lap('transport', len(res.content))
+        result = self._format_response(res.content)
+        timer.lap('parse')
+        return result
+
+    def _signRequest(self, url, values):
+        """
+        Build the form data and headers for a message signed through
+        the traditional method.
+        """
+        headers = {}
+        values['timestamp'] = int(time.time())
+        values['nonce'] = createNonce(20)
+        values['endpoint'] = url[4:] if url.startswith('/api') else url
+        headers['cpt-key'] = self.key
+        signdata = base64.b64encode(self.codec.dumps(values))
+        headers['cpt-hmac'] = generateHmac(signdata, self.secret)
+        return {'data': signdata}, headers
 
     def _format_response(self, result):
-        resp = json.loads(result)
+        resp = self.codec.loads(result)
         if 'error' in resp:
             raise CoinapultError(resp['error'])
         else:
             return resp
 
-    def _sendECC(self, url, values, newAccount=False, sign=True):
+    def _sendECC(self, url, values, newAccount=False, sign=True, trace=None):
         """
         Send authenticated messages using ECC. It is possible to
         create an account using this authentication method.
@@ -127,7 +549,18 @@ class CoinapultClient():
         Note that sign is always assumed to be True, this is defined
         in order to keep signature compatibility with _sendRequest.
         """
-        if self.ecc is None:
+        timer = _NULL_TIMER if trace is None else _PhaseTimer(trace)
+        data, headers = self._signECC(url, values, newAccount)
+        timer.lap('sign')
+        res = self._http(url, data, headers)
+        timer.lap('transport', len(res.content))
+        result = self._format_response(res.content)
+        timer.lap('parse')
+        return result
+
+    def _signECC(self, url, values, newAccount=False):
+        """Build the form data and headers for a message signed with ECC."""
+        if self._loadECC() is None:
             raise CoinapultError("ECC disabled")
 
         headers = {}
@@ -139,33 +572,246 @@ class CoinapultClient():
             headers['cpt-ecc-new'] = base64.b64encode(self.ecc_pub_pem)
         values['timestamp'] = int(time.time())
 
-        data = base64.b64encode(json.dumps(values))
-        headers['cpt-ecc-sign'] = generateECCsign(data, self.ecc['privkey'])
+        data = base64.b64encode(self.codec.dumps(values))
+        if self.signingPool is not None:
+            headers['cpt-ecc-sign'] = self.signingPool.sign(data)
+        else:
+            headers['cpt-ecc-sign'] = generateECCsign(data, self.ecc['privkey'])
+        return {'data': data}, headers
 
-        res = requests.post(urljoin(self.baseURL, url), data={'data': data},
-                            headers=headers)
-        return self._format_response(res.text)
+    def startSigningPool(self, processes=None):
+        """
+        Sign ECC requests in a pool of worker processes from now on.
+        Useful when making many concurrent requests, e.g. with sendMany,
+        while using the pure Python ecdsa backend.
+        """
+        if self._loadECC() is None:
+            raise CoinapultError("ECC disabled")
+        self.signingPool = ECCSigningPool(self.ecc['privkey'].to_pem(),
+                                          processes)
 
-    def _receiveECC(self, resp):
+    def _receiveECC(self, resp, trace=None):
         """Decode a signed ECC response."""
+        timer = _NULL_TIMER if trace is None else _PhaseTimer(trace)
         if 'sign' not in resp or 'data' not in resp:
             raise CoinapultErrorECC('Invalid ECC message')
         # Check signature.
-        if not verifyECCsign(resp['sign'], resp['data'], ECC_COINAPULT_PUBKEY):
+        if not verifyCoinapultSign(resp['sign'], resp['data'],
+                                   self.coinapultPub):
             raise CoinapultErrorECC('Invalid ECC signature')
+        timer.lap('verify')
 
-        form = json.loads(base64.b64decode(resp['data']))
+        form = self.codec.loads(base64.b64decode(resp['data']))
+        timer.lap('parse')
         return form
 
+    def _exchangeECC(self, url, values):
+        """
+        Send a message for a new account and decode the signed response.
+        """
+        if not self._hooks:
+            return self._receiveECC(self._sendECC(url, values, newAccount=True))
+        return self._instrument(url, 'ecc', lambda trace: self._receiveECC(
+            self._sendECC(url, values, newAccount=True, trace=trace),
+            trace=trace))
+
+    def addHook(self, hook):
+        """
+        Call hook(event) after every request made through
+        sendToCoinapult, or when creating and activating accounts.
+        The event is a dict holding:
+
+          * endpoint: the API endpoint, e.g. '/api/t/send/'
+          * authmethod: 'ecc', 'creds' or None for unsigned requests
+          * start: time.time() when the request started
+          * total: seconds taken by the whole call
+          * timings: seconds spent in each phase of the request, among
+            'sign', 'transport', 'parse' and 'verify'
+          * responseSize: size of the response body in bytes, or None
+          * error: class name of the exception raised, or None
+
+        Exceptions raised by hooks are ignored. See RequestStats for
+        a hook that aggregates the events in memory.
+        """
+        self._hooks = self._hooks + [hook]
+
+    def removeHook(self, hook):
+        # Equality, as every access to a bound method creates a new one.
+        self._hooks = [item for item in self._hooks if item != hook]
+
+    def _instrument(self, endpoint, authmethod, call):
+        """Run call(trace) and report the resulting event to the hooks."""
+        trace = {}
+        event = {'endpoint': endpoint, 'authmethod': authmethod,
+                 'start': time.time(), 'timings': trace, 'error': None}
+        try:
+            return call(trace)
+        except Exception, err:
+            event['error'] = err.__class__.__name__
+            raise
+        finally:
+            event['total'] = time.time() - event['start']
+            event['responseSize'] = trace.pop('size', None)
+            for hook in self._hooks:
+                try:
+                    hook(event)
+                except Exception:
+                    pass
+
     def sendToCoinapult(self, endpoint, values, sign=False, **kwargs):
         """
         Send a message to an API endpoint and return response contents.
         """
+        if (self.callTimeout is not None and
+                getattr(self._local, 'deadline', None) is None):
+            with self.deadline(self.callTimeout):
+                return self._coalesce(endpoint, values, sign, kwargs)
+        return self._coalesce(endpoint, values, sign, kwargs)
+
+    def _coalesce(self, endpoint, values, sign, kwargs):
+        if self._singleFlight is not None and endpoint in COALESCE_ENDPOINTS:
+            key = (endpoint, sign, json.dumps(values, sort_keys=True),
+                   tuple(sorted(kwargs.items())))
+            # Waits for the call in flight at most until our deadline.
+            return self._singleFlight.do(
+                key, lambda: self._deliver(endpoint, values, sign, kwargs),
+                self._remaining())
+        return self._deliver(endpoint, values, sign, kwargs)
+
+    def _deliver(self, endpoint, values, sign, kwargs):
+        """Send a request, applying rate limits and retries if enabled."""
+        if self.rateLimiter is None and self.retry is None:
+            return self._attempt(endpoint, values, sign, kwargs)
+
+        attempt = 0
+        while True:
+            if self.rateLimiter is not None:
+                self.rateLimiter.acquire(endpoint)
+            try:
+                # Every attempt is signed again with a new nonce and
+                # timestamp, so copy the original values.
+                return self._attempt(endpoint, dict(values), sign, kwargs)
+            except Exception, err:
+                excinfo = sys.exc_info()
+                sent = transientError(err)
+                if (self.retry is None or sent is None or
+                        attempt >= self.retry.retries or
+                        isinstance(err, CoinapultDeadlineError)):
+                    raise
+                if sent and not isReplayable(endpoint, values):
+                    raise
+                delay = self.retry.delay(attempt + 1, err)
+                remaining = self._remaining(sent)
+                if remaining is not None and delay >= remaining:
+                    # No time left for another attempt.
+                    raise
+            attempt += 1
+            time.sleep(delay)
+            if sent and endpoint in EXTOID_ENDPOINTS:
+                try:
+                    previous = self._findExtOID(values['extOID'])
+                except Exception:
+                    # It may have been processed, do not send it again.
+                    raise excinfo[0], excinfo[1], excinfo[2]
+                if previous is not None:
+                    return previous
+
+    def _findExtOID(self, extOID):
+        """
+        Return the transaction created with extOID, or None if
+        Coinapult answered that there is none.
+
+        :raises: the error of the search if it got no answer, e.g.
+            CoinapultTransientError
+        """
+        try:
+            # Not self.search, which returns a Future on
+            # AsyncCoinapultClient.
+            found = CoinapultClient.search(self, extOID=extOID)
+        except CoinapultTransientError:
+            raise
+        except CoinapultError:
+            # An error answered by Coinapult, e.g. transaction not found.
+            return None
+        if isinstance(found, dict) and found.get('extOID') == extOID:
+            return found
+        return None
+
+    def _attempt(self, endpoint, values, sign, kwargs):
+        """Send a request, hedging it if enabled for the endpoint."""
+        if self.hedgeDelay is None or endpoint not in HEDGE_ENDPOINTS:
+            return self._send(endpoint, values, sign, kwargs)
+        return self._hedge(endpoint, values, sign, kwargs)
+
+    def _hedge(self, endpoint, values, sign, kwargs):
+        """
+        Send a request from a thread of its own, and send a duplicate
+        from the hedging pool if it is not complete after hedgeDelay.
+        Return the first response received, the other copy finishing
+        in the background. Raise the error of the last one to fail.
+        """
+        if self._hedgePool is None:
+            with self._hedgeLock:
+                if self._hedgePool is None:
+                    self._hedgePool = ThreadPool(self._hedgeWorkers)
+        deadline = getattr(self._local, 'deadline', None)
+        wait = self.hedgeDelay
+        remaining = self._remaining()
+        if remaining is not None:
+            wait = min(wait, remaining)
+        # (succeeded, result or exc_info) of each copy, in the order
+        # they complete. Each copy is signed with its own nonce.
+        outcomes = Queue.Queue()
+        primary = threading.Thread(
+            target=self._runWithDeadline,
+            args=(deadline, self._sendCopy, outcomes, False, endpoint,
+                  dict(values), sign, kwargs))
+        primary.daemon = True
+        primary.start()
+        try:
+            succeeded, outcome = outcomes.get(timeout=wait)
+        except Queue.Empty:
+            self._hedgePool.apply_async(
+                self._runWithDeadline,
+                (deadline, self._sendCopy, outcomes, True, endpoint,
+                 dict(values), sign, kwargs))
+            succeeded, outcome = self._nextOutcome(outcomes)
+            if not succeeded:
+                succeeded, outcome = self._nextOutcome(outcomes)
+        if not succeeded:
+            raise outcome[0], outcome[1], outcome[2]
+        return outcome
+
+    def _nextOutcome(self, outcomes):
+        """Wait for the next copy of a hedged request to complete."""
+        try:
+            # Waiting without a timeout can not be interrupted.
+            return outcomes.get(
+                timeout=self._remaining(sent=True) or 86400 * 365)
+        except Queue.Empty:
+            raise CoinapultDeadlineError("deadline exceeded", sent=True)
+
+    def _sendCopy(self, outcomes, duplicate, endpoint, values, sign, kwargs):
+        """Send a copy of a hedged request and report how it went."""
+        try:
+            if duplicate and self.rateLimiter is not None:
+                self.rateLimiter.acquire(endpoint)
+            outcomes.put((True, self._send(endpoint, values, sign, kwargs)))
+        except Exception:
+            outcomes.put((False, sys.exc_info()))
+
+    def _send(self, endpoint, values, sign, kwargs):
+        self._remaining()
         method = self._sendRequest
+        authmethod = 'creds' if sign else None
         if sign and self.authmethod == 'ecc':
             method = self._sendECC
+            authmethod = 'ecc'
 
-        return method(endpoint, values, sign=sign, **kwargs)
+        if not self._hooks:
+            return method(endpoint, values, sign=sign, **kwargs)
+        return self._instrument(endpoint, authmethod, lambda trace: method(
+            endpoint, values, sign=sign, trace=trace, **kwargs))
 
     def createAccount(self, createLocalKeys=True, changeAuthMethod=True,
                       **kwargs):
@@ -182,8 +828,10 @@ class CoinapultClient():
         url = '/api/account/create'
         if createLocalKeys:
             self._setupECCPair()
+        else:
+            self._loadECC()
         pub_pem = self.ecc_pub_pem
-        result = self._receiveECC(self._sendECC(url, kwargs, newAccount=True))
+        result = self._exchangeECC(url, kwargs)
         if 'success' in result:
             if result['success'] != sha256(pub_pem).hexdigest():
                 raise CoinapultErrorECC('Unexpected public key')
@@ -208,9 +856,10 @@ class CoinapultClient():
         :rtype dict:
         """
         url = '/api/account/activate'
+        self._loadECC()
         pubhash = pubhash or self.ecc_pub_hash
         values = {'agree': agree, 'hash': pubhash}
-        result = self._receiveECC(self._sendECC(url, values, newAccount=True))
+        result = self._exchangeECC(url, values)
         return result
 
     def receive(self, amount=0, outAmount=0, currency='BTC', outCurrency=None,
@@ -225,6 +874,9 @@ class CoinapultClient():
             raise CoinapultError('invalid amount')
         if not outCurrency:
             outCurrency = currency
+        if not extOID and self.retry is not None:
+            # Lets a retried invoice be found instead of duplicated.
+            extOID = createNonce(20)
 
         url = '/api/t/receive/'
         values = dict(**kwargs)
@@ -258,6 +910,9 @@ class CoinapultClient():
 
         url = '/api/t/send/'
         values = dict(**kwargs)
+        if not values.get('extOID') and self.retry is not None:
+            # Lets a retried payment be found instead of duplicated.
+            values['extOID'] = createNonce(20)
         values['amount'] = amount
         values['currency'] = currency
         values['address'] = str(address)
@@ -272,6 +927,62 @@ class CoinapultClient():
         else:
             raise CoinapultError("unknown response from Coinapult")
 
+    def sendMany(self, payouts, concurrency=8):
+        """
+        Send money to many recipients concurrently.
+
+        Every payout is checked before any request is made, so a bad
+        row raises CoinapultError without sending anything. Results are
+        produced as they complete, not in the original order, and a
+        failed payout does not stop the others.
+
+        :param payouts: iterable of dicts holding the arguments to send,
+            e.g. {'amount': 0.1, 'address': '1...'}
+        :param int concurrency: maximum number of payouts in flight;
+            keep it at or below the connection pool size
+        :rtype generator:
+        :return: (index, result) pairs, where result is either the
+            response from send or a CoinapultError for the failure. On
+            AsyncCoinapultClient too, the payouts are sent when the
+            generator is consumed
+        """
+        payouts = list(payouts)
+        for index, payout in enumerate(payouts):
+            try:
+                validateAmounts(payout.get('amount'), payout.get('outAmount'))
+                if payout.get('address') is None:
+                    raise CoinapultError('address required')
+            except CoinapultError, err:
+                raise CoinapultError('payout %d: %s' % (index, err))
+
+        return self._sendMany(payouts, concurrency)
+
+    def _sendMany(self, payouts, concurrency):
+        def run(item):
+            index, payout = item
+            payout = dict(payout)
+            try:
+                # Not self.send, which returns a Future on
+                # AsyncCoinapultClient.
+                return index, CoinapultClient.send(
+                    self, payout.pop('amount', 0), payout.pop('address'),
+                    **payout)
+            except CoinapultError, err:
+                return index, err
+            except Exception, err:
+                # Anything else, e.g. an unparsable response, must not
+                # abort the other payouts.
+                return index, CoinapultError('%s: %s' % (
+                    err.__class__.__name__, err))
+
+        pool = ThreadPool(max(1, min(concurrency, len(payouts))))
+        try:
+            for result in pool.imap_unordered(run, enumerate(payouts)):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
     def convert(self, amount, inCurrency='USD', outAmount=0, outCurrency='BTC', **kwargs):
         """Convert balance from one currency to another."""
         url = '/api/t/convert/'
@@ -296,11 +1007,18 @@ class CoinapultClient():
 
     def search(self, transaction_id=None, typ=None, currency=None, to=None,
                fro=None, extOID=None, txhash=None, many=False, page=None,
-               situation=None, **kwargs):
+               situation=None, stream=False, meta=None, **kwargs):
         """Search for a transaction by common fields.
 
         To search for many transactions, set many=True and optionally
-        specify a page number."""
+        specify a page number.
+
+        If stream is True together with many, a generator is returned
+        instead, yielding the transactions while the response is being
+        read, so that only one of them is held in memory at a time. The
+        other keys in the response (page, pageCount) are stored in the
+        dict meta, if given, once the generator is exhausted. Streamed
+        requests are not retried, coalesced or reported to hooks."""
         url = '/api/t/search/'
 
         values = {}
@@ -329,8 +1047,91 @@ class CoinapultClient():
         if page is not None:
             values['page'] = page
 
+        if stream and many:
+            return self._streamArray(url, values, 'result', meta)
         return self.sendToCoinapult(url, values, sign=True)
 
+    def _streamArray(self, url, values, key, meta):
+        """
+        Send a signed request and yield the items of the array found
+        under key in the response as they are parsed.
+        """
+        if self.rateLimiter is not None:
+            self.rateLimiter.acquire(url)
+        self._remaining()
+        if self.authmethod == 'ecc':
+            data, headers = self._signECC(url, values)
+        else:
+            data, headers = self._signRequest(url, values)
+        res = self._http(url, data, headers, stream=True)
+        try:
+            chunks = res.iter_content(self.streamChunkSize)
+            for item in iterJSONArray(chunks, key, meta):
+                yield item
+        finally:
+            res.close()
+
+    def iterSearch(self, page=1, prefetch=True, stream=False, **kwargs):
+        """
+        Iterate over every transaction found by search(many=True),
+        starting at the given page and requesting the following ones
+        as needed. Accepts the same search parameters as search.
+
+        At most two pages are held in memory at a time. If prefetch is
+        True, the next page is requested in the background while the
+        current one is consumed. Closing the generator early waits for
+        that request to finish.
+
+        If stream is True, each page is streamed as described in
+        search, one page after the other, and prefetch is ignored.
+
+        :rtype generator:
+        """
+        kwargs.pop('many', None)
+        if stream:
+            return self._iterSearchStream(page, kwargs)
+        return self._iterSearch(page, prefetch, kwargs)
+
+    def _iterSearchStream(self, page, kwargs):
+        while True:
+            meta = {}
+            for item in CoinapultClient.search(self, many=True, page=page,
+                                               stream=True, meta=meta,
+                                               **kwargs):
+                yield item
+            if page >= meta.get('pageCount', page):
+                break
+            page += 1
+
+    def _iterSearch(self, page, prefetch, kwargs):
+        def fetch(num):
+            # Not self.search, which returns a Future on
+            # AsyncCoinapultClient.
+            return CoinapultClient.search(self, many=True, page=num, **kwargs)
+
+        pool = ThreadPool(1) if prefetch else None
+        try:
+            current = fetch(page)
+            while True:
+                more = page < current.get('pageCount', page)
+                following = None
+                if more and pool is not None:
+                    following = submit(pool, fetch, page + 1)
+                for item in current.get('result', ()):
+                    yield item
+                if not more:
+                    break
+                page += 1
+                current = None
+                if following is not None:
+                    current = following.result()
+                else:
+                    current = fetch(page)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
     def lock(self, amount, outAmount=0, currency='USD', callback=None, **kwargs):
         """Lock a certain amount of bitcoins to another currency."""
         url = '/api/t/lock/'
@@ -434,8 +1235,15 @@ class CoinapultClient():
         else:
             raise CoinapultError("unknown response from Coinapult")
 
-    def getTicker(self, begin=None, end=None, market=None, filter=None, **kwargs):
-        """Get exchange rates."""
+    def getTicker(self, begin=None, end=None, market=None, filter=None,
+                  withAge=False, **kwargs):
+        """
+        Get exchange rates.
+
+        :param bool withAge: if True, return a (ticker, age) pair where
+            age is how many seconds ago the ticker was fetched. This is
+            only ever non-zero when a tickerCache is in use
+        """
         url = '/api/ticker/'
 
         values = {}
@@ -448,7 +1256,15 @@ class CoinapultClient():
         if filter is not None:
             values['filter'] = filter
 
-        return self.sendToCoinapult(url, values, post=False)
+        if self.tickerCache is None:
+            result, age = self.sendToCoinapult(url, values, post=False), 0.0
+        else:
+            result, age = self.tickerCache.get(
+                (begin, end, market, filter),
+                lambda: self.sendToCoinapult(url, dict(values), post=False))
+        if withAge:
+            return result, age
+        return result
 
     def getBitcoinAddress(self):
         """generate a new bitcoin address"""
@@ -486,7 +1302,7 @@ class CoinapultClient():
         Upon success, returns nothing."""
         if recvKey is None:
             # ECC auth.
-            if not verifyECCsign(recvSign, recvData, ECC_COINAPULT_PUBKEY):
+            if not verifyCoinapultSign(recvSign, recvData, self.coinapultPub):
                 raise CoinapultErrorECC('ECC signature does not match')
             return
 
@@ -510,6 +1326,585 @@ class CoinapultErrorECC(CoinapultError):
     pass
 
 
+class LRUCache(object):
+    """
+    Thread safe mapping holding up to maxsize items, discarding the
+    least recently used ones first. Lookups are counted in the hits
+    and misses attributes.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Return a dict with the current size and hit/miss counters."""
+        return {'size': len(self._data), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses}
+
+
+class TickerCache(object):
+    """
+    In-process cache for ticker results.
+
+    Values younger than ttl seconds are served from memory. Values up
+    to ttl + staleTTL seconds old are still served, while a single
+    background request refreshes them. Older values are fetched again
+    before returning. At most maxsize distinct queries are kept.
+    """
+
+    def __init__(self, ttl=10, staleTTL=60, maxsize=64):
+        self.ttl = ttl
+        self.staleTTL = staleTTL
+        self._entries = LRUCache(maxsize)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, key, fetch):
+        """
+        Return a (value, age) pair for key, calling fetch() to obtain
+        a fresh value when needed.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, fetched = entry
+            age = time.time() - fetched
+            if age < self.ttl:
+                return value, age
+            if age < self.ttl + self.staleTTL:
+                self._refresh(key, fetch)
+                return value, age
+        return self._fetch(key, fetch), 0.0
+
+    def _fetch(self, key, fetch):
+        value = fetch()
+        self._entries.put(key, (value, time.time()))
+        return value
+
+    def _refresh(self, key, fetch):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                self._fetch(key, fetch)
+            except Exception:
+                # Keep serving the stale value until it expires.
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def clear(self):
+        self._entries.clear()
+
+
+class _PhaseTimer(object):
+    """Accumulate the time taken by each phase of a request in timings."""
+
+    def __init__(self, timings):
+        self.timings = timings
+        self.last = time.time()
+
+    def lap(self, phase, size=None):
+        """Record the time since the previous lap as the given phase."""
+        now = time.time()
+        self.timings[phase] = self.timings.get(phase, 0) + now - self.last
+        self.last = now
+        if size is not None:
+            self.timings['size'] = size
+
+
+class _NullTimer(object):
+    def lap(self, phase, size=None):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class RequestStats(object):
+    """
+    Hook for CoinapultClient.addHook that aggregates request events in
+    histograms per endpoint, for the total duration and for each phase.
+
+    Buckets are upper bounds in seconds; durations above the last one
+    are counted in an extra overflow bucket.
+    """
+
+    BUCKETS = tuple(0.0005 * 2 ** i for i in range(16))
+
+    def __init__(self, buckets=BUCKETS, callback=None):
+        """
+        :param callback: if specified, every event is also passed to
+            it, e.g. for exporting it to a metrics system
+        """
+        self.buckets = tuple(buckets)
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def __call__(self, event):
+        with self._lock:
+            stats = self._endpoints.get(event['endpoint'])
+            if stats is None:
+                stats = self._endpoints[event['endpoint']] = {
+                    'count': 0, 'errors': {}, 'responseSize': 0,
+                    'histograms': {}}
+            stats['count'] += 1
+            stats['responseSize'] += event['responseSize'] or 0
+            if event['error'] is not None:
+                errors = stats['errors']
+                errors[event['error']] = errors.get(event['error'], 0) + 1
+            self._record(stats, 'total', event['total'])
+            for phase, seconds in event['timings'].iteritems():
+                self._record(stats, phase, seconds)
+        if self.callback is not None:
+            self.callback(event)
+
+    def _record(self, stats, name, seconds):
+        histogram = stats['histograms'].get(name)
+        if histogram is None:
+            histogram = stats['histograms'][name] = {
+                'count': 0, 'sum': 0.0, 'max': 0.0,
+                'buckets': [0] * (len(self.buckets) + 1)}
+        histogram['count'] += 1
+        histogram['sum'] += seconds
+        histogram['max'] = max(histogram['max'], seconds)
+        histogram['buckets'][bisect.bisect_left(self.buckets, seconds)] += 1
+
+    def percentile(self, endpoint, q, name='total'):
+        """
+        Estimate the q-th percentile (0 to 100) of the given duration
+        for endpoint, as the upper bound of the bucket holding it.
+        """
+        with self._lock:
+            histogram = self._endpoints[endpoint]['histograms'][name]
+            rank = q / 100.0 * histogram['count']
+            seen = 0
+            for index, count in enumerate(histogram['buckets']):
+                seen += count
+                if seen >= rank and count:
+                    if index < len(self.buckets):
+                        return self.buckets[index]
+                    return histogram['max']
+            return histogram['max']
+
+    def snapshot(self):
+        """Return a deep copy of the statistics, keyed by endpoint."""
+        with self._lock:
+            return json.loads(json.dumps(self._endpoints))
+
+    def reset(self):
+        with self._lock:
+            self._endpoints = {}
+
+
+class TokenBucket(object):
+    """
+    Allow on average rate operations per second, with bursts of up
+    to burst operations.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until an operation is allowed."""
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst,
+                                   self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class RateLimiter(object):
+    """
+    One TokenBucket per endpoint family. Requests are counted against
+    the longest matching prefix and are not limited if none matches.
+    """
+
+    def __init__(self, limits):
+        """:param dict limits: {prefix: (rate, burst)}"""
+        self.buckets = sorted(
+            ((prefix, TokenBucket(rate, burst))
+             for prefix, (rate, burst) in limits.iteritems()),
+            key=lambda item: len(item[0]), reverse=True)
+
+    def acquire(self, endpoint):
+        for prefix, bucket in self.buckets:
+            if endpoint.startswith(prefix):
+                bucket.acquire()
+                return
+
+
+class RetryPolicy(object):
+    """
+    Retry transient failures (connection errors, timeouts and HTTP
+    429, 502, 503 and 504) up to retries times, waiting a random time
+    of up to backoff * 2 ** attempt seconds, capped at maxBackoff, or
+    as long as the server asked through Retry-After.
+
+    Requests that failed before reaching Coinapult are always retried.
+    Requests that may have been processed are retried only if they are
+    read only, or if they are a receive or send carrying an extOID. In
+    that case the transaction is searched for by extOID first and
+    returned if it exists. When a retry policy is in use, receive and
+    send generate an extOID unless one is given.
+    """
+
+    def __init__(self, retries=3, backoff=0.5, maxBackoff=30):
+        self.retries = retries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+
+    def delay(self, attempt, err=None):
+        """Seconds to wait before the given attempt (1 for the first retry)."""
+        delay = random.uniform(0, min(self.maxBackoff,
+                                      self.backoff * 2 ** attempt))
+        retryAfter = getattr(err, 'retryAfter', None)
+        if retryAfter:
+            try:
+                delay = max(delay, min(self.maxBackoff, float(retryAfter)))
+            except ValueError:
+                pass
+        return delay
+
+
+# Signatures from Coinapult that were already verified, keyed on
+# (signature, sha256(data), key PEM or None for Coinapult's), so
+# redelivered messages are not verified again.
+ECC_VERIFY_CACHE = LRUCache(4096)
+
+
+class CoinapultTransientError(CoinapultError):
+    """
+    A request failed in a way that may succeed if tried again later.
+
+    sent tells whether the request may have been processed by
+    Coinapult, and retryAfter holds the Retry-After header, if any.
+    """
+
+    def __init__(self, message, sent=True, retryAfter=None):
+        CoinapultError.__init__(self, message)
+        self.sent = sent
+        self.retryAfter = retryAfter
+
+
+class CoinapultDeadlineError(CoinapultTransientError):
+    """
+    The deadline of a call expired before it completed. It is never
+    retried. See CoinapultClient.deadline.
+    """
+
+
+# HTTP status codes that indicate a transient failure.
+TRANSIENT_STATUS = (429, 502, 503, 504)
+
+# Read only endpoints, which can be repeated without side effects.
+READ_ENDPOINTS = frozenset([
+    '/api/ticker/', '/api/accountInfo/', '/api/accountInfo/address',
+    '/api/t/search/'])
+
+# Endpoints whose requests may be hedged, see the hedgeDelay parameter
+# of CoinapultClient. Only read only endpoints belong here.
+HEDGE_ENDPOINTS = READ_ENDPOINTS
+
+# Endpoints whose transactions can be found by extOID after a failure.
+EXTOID_ENDPOINTS = frozenset(['/api/t/receive/', '/api/t/send/'])
+
+
+# Read only endpoints whose concurrent identical requests can share a
+# single response, see the coalesce parameter of CoinapultClient.
+COALESCE_ENDPOINTS = frozenset([
+    '/api/ticker/', '/api/accountInfo/', '/api/accountInfo/address'])
+
+
+def transientError(err):
+    """
+    Classify an exception raised while sending a request. Returns None
+    if it is not transient, otherwise whether the request may have
+    reached Coinapult.
+    """
+    if isinstance(err, CoinapultTransientError):
+        return err.sent
+    if isinstance(err, requests.ConnectTimeout):
+        return False
+    if isinstance(err, (requests.ConnectionError, requests.Timeout)):
+        return True
+    return None
+
+
+def isReplayable(endpoint, values):
+    """
+    Whether a request that may have been processed already can be
+    sent again: either it is read only, or it creates a transaction
+    with an extOID that can be searched for first.
+    """
+    if endpoint in READ_ENDPOINTS:
+        return True
+    return endpoint in EXTOID_ENDPOINTS and bool(values.get('extOID'))
+
+
+class Future(object):
+    """
+    Placeholder for the result of an operation running in the
+    background.
+    """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._excinfo = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Wait up to timeout seconds for the operation, and return
+        whether it finished.
+        """
+        return self._done.wait(timeout)
+
+    def setResult(self, result):
+        self._result = result
+        self._finish()
+
+    def setException(self, excinfo=None):
+        """
+        Mark the operation as failed.
+
+        :param tuple excinfo: as returned by sys.exc_info(), which is
+            used when not specified
+        """
+        self._excinfo = excinfo or sys.exc_info()
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def addDoneCallback(self, callback):
+        """
+        Call callback(future) once the operation finishes. If it
+        already did, callback is called right away.
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def exception(self, timeout=None):
+        """Wait for the operation and return the exception it raised."""
+        if not self._done.wait(timeout):
+            raise CoinapultError("operation timed out")
+        return self._excinfo[1] if self._excinfo else None
+
+    def result(self, timeout=None):
+        """
+        Wait up to timeout seconds for the operation and return its
+        result, or raise the exception it raised.
+        """
+        if not self._done.wait(timeout):
+            raise CoinapultError("operation timed out")
+        if self._excinfo:
+            raise self._excinfo[0], self._excinfo[1], self._excinfo[2]
+        return self._result
+
+
+class SingleFlight(object):
+    """
+    Run at most one call per key at a time. Callers arriving while a
+    call for their key is in progress wait for it and receive the same
+    result, or exception, instead of calling again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, timeout=None):
+        """
+        Return func(), or the result of the call for key in progress.
+
+        :param timeout: seconds to wait for a call in progress, None
+            waits until it completes
+        :raises CoinapultDeadlineError: if the timeout expires, with
+            sent set as the call in progress may have been processed
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if leader:
+            try:
+                future.setResult(func())
+            except Exception:
+                future.setException()
+            finally:
+                with self._lock:
+                    del self._calls[key]
+        elif not future.wait(timeout):
+            raise CoinapultDeadlineError(
+                "deadline exceeded waiting for the same call", sent=True)
+        return future.result()
+
+
+def _runInto(future, func, args, kwargs):
+    try:
+        result = func(*args, **kwargs)
+    except Exception:
+        future.setException()
+    else:
+        future.setResult(result)
+
+
+def submit(pool, func, *args, **kwargs):
+    """
+    Run func(*args, **kwargs) on a multiprocessing.pool.ThreadPool
+    and return a Future for its result.
+    """
+    future = Future()
+    pool.apply_async(_runInto, (future, func, args, kwargs))
+    return future
+
+
+def _backgroundMethod(name):
+    method = getattr(CoinapultClient, name)
+
+    def run(self, *args, **kwargs):
+        # The deadline of the caller applies in the worker thread.
+        deadline = getattr(self._local, 'deadline', None)
+        return submit(self.executor, self._runWithDeadline, deadline,
+                      method, self, *args, **kwargs)
+    run.__name__ = name
+    run.__doc__ = method.__doc__
+    return run
+
+
+class AsyncCoinapultClient(CoinapultClient):
+    """
+    CoinapultClient whose API calls do not block the caller.
+
+    Every API method takes the same arguments as in CoinapultClient
+    but returns a Future right away. Requests, including the signing
+    and verification of ECC messages, run on a pool of worker threads
+    that share a single pooled HTTP session. Calls made beyond the
+    number of workers are queued.
+
+    sendMany, iterSearch and search(stream=True) return generators
+    as in CoinapultClient, which make their requests as they are
+    consumed.
+    """
+
+    def __init__(self, credentials=None, baseURL='https://api.coinapult.com',
+                 ecc=None, authmethod=None, workers=16, **kwargs):
+        """
+        Accepts the same parameters as CoinapultClient, plus:
+
+        :param int workers: number of requests in flight at once. Unless
+            specified, the HTTP connection pool is sized to match
+        """
+        kwargs.setdefault('poolMaxsize', workers)
+        CoinapultClient.__init__(self, credentials, baseURL, ecc, authmethod,
+                                 **kwargs)
+        self.executor = ThreadPool(workers)
+
+    def close(self):
+        """Wait for pending calls and release workers and connections."""
+        if self.executor is not None:
+            self.executor.close()
+            self.executor.join()
+            self.executor = None
+        CoinapultClient.close(self)
+
+    createAccount = _backgroundMethod('createAccount')
+    activateAccount = _backgroundMethod('activateAccount')
+    receive = _backgroundMethod('receive')
+    send = _backgroundMethod('send')
+    convert = _backgroundMethod('convert')
+    _search = _backgroundMethod('search')
+
+    def search(self, *args, **kwargs):
+        if kwargs.get('stream'):
+            # Already lazy: the request is sent when the generator is
+            # first consumed.
+            return CoinapultClient.search(self, *args, **kwargs)
+        return self._search(*args, **kwargs)
+    search.__doc__ = CoinapultClient.search.__doc__
+    lock = _backgroundMethod('lock')
+    lockFor = _backgroundMethod('lockFor')
+    lockPayFor = _backgroundMethod('lockPayFor')
+    lockTransfer = _backgroundMethod('lockTransfer')
+    unlock = _backgroundMethod('unlock')
+    unlockConfirm = _backgroundMethod('unlockConfirm')
+    getTicker = _backgroundMethod('getTicker')
+    getBitcoinAddress = _backgroundMethod('getBitcoinAddress')
+    configAddress = _backgroundMethod('configAddress')
+    accountInfo = _backgroundMethod('accountInfo')
+    accountAddress = _backgroundMethod('accountAddress')
+    updateEmail = _backgroundMethod('updateEmail')
+
+
 def generateECCsign(data, privkey):
     """
     Sign data using ECDSA-SHA256.
@@ -520,12 +1915,11 @@ def generateECCsign(data, privkey):
     :return: the signature pair (r, s) concatenated and formatted as a
         hexadecimal string
     """
-    if privkey.curve.name != ecdsa.SECP256k1.name:
+    if privkey.curve.name != loadECDSA().SECP256k1.name:
         raise CoinapultErrorECC('key on curve %s, expected secp256k1' %
                                 privkey.curve.name)
     hmsg = sha256(data).digest()
-    sign = privkey.sign_digest_deterministic(hmsg, sha256)
-    return sign.encode('hex')
+    return eccBackend().sign(privkey, hmsg).encode('hex')
 
 
 def verifyECCsign(signstr, origdata, pubkey):
@@ -538,11 +1932,248 @@ def verifyECCsign(signstr, origdata, pubkey):
     :rtype bool:
     :raises ecdsa.keys.BadSignatureError:
     """
-    if pubkey.curve.name != ecdsa.SECP256k1.name:
+    if pubkey.curve.name != loadECDSA().SECP256k1.name:
         raise CoinapultErrorECC('key on curve %s, expected secp256k1' %
                                 pubkey.curve.name)
     sign = signstr.decode('hex')
-    return pubkey.verify(sign, origdata, sha256)
+    return eccBackend().verify(pubkey, sign, sha256(origdata).digest())
+
+
+class EcdsaBackend(object):
+    """ECDSA over secp256k1 implemented by the pure Python ecdsa package."""
+
+    name = 'ecdsa'
+
+    def sign(self, privkey, digest):
+        """Return the deterministic (RFC 6979) signature r || s of digest."""
+        return privkey.sign_digest_deterministic(digest, sha256)
+
+    def verify(self, pubkey, sign, digest):
+        return pubkey.verify_digest(sign, digest)
+
+
+class CoincurveBackend(object):
+    """
+    ECDSA over secp256k1 using the point arithmetic of libsecp256k1,
+    through the coincurve package. Keys are still ecdsa objects.
+
+    Signatures are byte-identical to the ones from EcdsaBackend: the
+    nonce is derived as in RFC 6979 and s is not normalized, while the
+    scalar multiplication is done natively.
+    """
+
+    name = 'coincurve'
+
+    def __init__(self):
+        import coincurve
+        self.coincurve = coincurve
+        self.order = loadECDSA().SECP256k1.order
+        self._pubkeys = LRUCache(256)
+
+    def sign(self, privkey, digest):
+        secexp = privkey.privkey.secret_multiplier
+        n = self.order
+        z = int(digest.encode('hex'), 16)
+        k = rfc6979Nonce(secexp, digest, n)
+        point = self.coincurve.PublicKey.from_secret(_intToBytes(k)).point()
+        r = point[0] % n
+        s = pow(k, n - 2, n) * (z + r * secexp) % n
+        if not r or not s:
+            # Practically impossible, let ecdsa pick the next nonce.
+            return EcdsaBackend().sign(privkey, digest)
+        return _intToBytes(r) + _intToBytes(s)
+
+    def verify(self, pubkey, sign, digest):
+        if len(sign) != 64:
+            raise loadECDSA().BadSignatureError('invalid signature length')
+        raw = pubkey.to_string()
+        native = self._pubkeys.get(raw)
+        if native is None:
+            native = self.coincurve.PublicKey('\x04' + raw)
+            self._pubkeys.put(raw, native)
+        r = int(sign[:32].encode('hex'), 16)
+        s = int(sign[32:].encode('hex'), 16)
+        # libsecp256k1 only accepts the lower of s and n - s, which
+        # are equally valid.
+        s = min(s, self.order - s)
+        if not (0 < r < self.order and 0 < s):
+            raise loadECDSA().BadSignatureError('invalid signature')
+        if not native.verify(_derSignature(r, s), digest, hasher=None):
+            raise loadECDSA().BadSignatureError('signature verification failed')
+        return True
+
+
+ECC_BACKENDS = {'ecdsa': EcdsaBackend, 'coincurve': CoincurveBackend}
+_eccBackend = None
+
+
+def eccBackend():
+    """
+    Return the ECDSA implementation in use. Unless set with
+    setECCBackend, coincurve is used if installed, otherwise ecdsa.
+    """
+    global _eccBackend
+    if _eccBackend is None:
+        try:
+            _eccBackend = CoincurveBackend()
+        except ImportError:
+            _eccBackend = EcdsaBackend()
+    return _eccBackend
+
+
+def setECCBackend(name):
+    """Choose the ECDSA implementation, 'ecdsa' or 'coincurve'."""
+    global _eccBackend
+    _eccBackend = ECC_BACKENDS[name]()
+
+
+def rfc6979Nonce(secexp, digest, order):
+    """
+    Derive the ECDSA nonce for signing digest with the private
+    exponent secexp as described in RFC 6979, using HMAC-SHA256, as
+    done by the ecdsa package.
+    """
+    qlen = len(bin(order)) - 2
+    rolen = (qlen + 7) // 8
+
+    def bits2int(data):
+        value = int(data.encode('hex'), 16)
+        excess = len(data) * 8 - qlen
+        return value >> excess if excess > 0 else value
+
+    z = bits2int(digest)
+    if z >= order:
+        z -= order
+    bx = _intToBytes(secexp, rolen) + _intToBytes(z, rolen)
+
+    v = '\x01' * 32
+    k = '\x00' * 32
+    k = hmac.new(k, v + '\x00' + bx, sha256).digest()
+    v = hmac.new(k, v, sha256).digest()
+    k = hmac.new(k, v + '\x01' + bx, sha256).digest()
+    v = hmac.new(k, v, sha256).digest()
+    while True:
+        t = ''
+        while len(t) < rolen:
+            v = hmac.new(k, v, sha256).digest()
+            t += v
+        nonce = bits2int(t[:rolen])
+        if 1 <= nonce < order:
+            return nonce
+        k = hmac.new(k, v + '\x00', sha256).digest()
+        v = hmac.new(k, v, sha256).digest()
+
+
+def _intToBytes(value, length=32):
+    return ('%0*x' % (length * 2, value)).decode('hex')
+
+
+def _derSignature(r, s):
+    def integer(value):
+        data = _intToBytes(value).lstrip('\x00')
+        if not data or ord(data[0]) & 0x80:
+            data = '\x00' + data
+        return '\x02' + chr(len(data)) + data
+    body = integer(r) + integer(s)
+    return '\x30' + chr(len(body)) + body
+
+
+_signerKey = None
+
+
+def _initSigner(privkeyPEM):
+    global _signerKey
+    _signerKey = loadECDSA().SigningKey.from_pem(privkeyPEM)
+
+
+def _signWithSignerKey(data):
+    return generateECCsign(data, _signerKey)
+
+
+class ECCSigningPool(object):
+    """
+    Pool of processes signing data with a single private key, so that
+    signing with the pure Python ecdsa backend scales across cores.
+    """
+
+    def __init__(self, privkeyPEM, processes=None):
+        """
+        :param str privkeyPEM: private key on curve secp256k1 in PEM
+        :param int processes: defaults to the number of CPUs
+        """
+        import multiprocessing
+        self._pool = multiprocessing.Pool(processes, _initSigner,
+                                          (privkeyPEM,))
+
+    def sign(self, data):
+        """Same as generateECCsign(data, privkey), in a worker process."""
+        return self._pool.apply(_signWithSignerKey, (data,))
+
+    def signMany(self, datas, chunksize=16):
+        """Sign every item of datas, returning the signatures in order."""
+        return self._pool.map(_signWithSignerKey, datas, chunksize)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+
+def _verifyInWorker(signstr, origdata, pem):
+    try:
+        return bool(verifyCoinapultSign(signstr, origdata, pem))
+    except Exception:
+        return False
+
+
+class ECCVerifyingPool(object):
+    """
+    Pool of processes verifying messages signed by Coinapult, so that
+    verifying with the pure Python ecdsa backend does not hold the GIL
+    of the calling threads.
+    """
+
+    def __init__(self, processes=None):
+        """:param int processes: defaults to the number of CPUs"""
+        import multiprocessing
+        self._pool = multiprocessing.Pool(processes)
+
+    def verify(self, signstr, origdata, pem=None):
+        """
+        Same as verifyCoinapultSign, in a worker process, except that
+        an invalid signature returns False instead of raising.
+        ECC_VERIFY_CACHE is consulted and updated in this process.
+        """
+        cachekey = (signstr, sha256(origdata).digest(), pem)
+        if ECC_VERIFY_CACHE.get(cachekey):
+            return True
+        valid = self._pool.apply(_verifyInWorker, (signstr, origdata, pem))
+        if valid:
+            ECC_VERIFY_CACHE.put(cachekey, True)
+        return valid
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+
+def verifyCoinapultSign(signstr, origdata, pem=None):
+    """
+    Verify a message signed by Coinapult, consulting ECC_VERIFY_CACHE
+    first and remembering successful verifications in it.
+
+    :param str signstr: a signature formatted as a hexadecimal string
+    :param str origdata: the original data used when creating the signature
+    :param str pem: public key to verify with instead of Coinapult's
+    :rtype bool:
+    :raises ecdsa.keys.BadSignatureError:
+    """
+    cachekey = (signstr, sha256(origdata).digest(), pem)
+    if ECC_VERIFY_CACHE.get(cachekey):
+        return True
+    valid = verifyECCsign(signstr, origdata, coinapultPubkey(pem))
+    if valid:
+        ECC_VERIFY_CACHE.put(cachekey, True)
+    return valid
 
 
 def generateHmac(message, secret):
@@ -0,0 +1,228 @@
+"""
+Clients for many Coinapult accounts sharing one connection pool.
+
+A ClientPool holds the credentials of every account, and creates a
+CoinapultClient for an account when it is first used. The clients are
+kept, with their parsed ECC keys and ecc_pub_hash, until they have
+been idle for a while or until too many of them exist, and they all
+send their requests through the same pooled session. For example:
+
+    from coinapult_accounts import ClientPool
+
+    pool = ClientPool(maxConcurrent=4)
+    pool.register('merchant-1', credentials={'key': ..., 'secret': ...})
+    pool.register('merchant-2', ecc={'privkey': ..., 'pubkey': ...})
+
+    with pool.acquire('merchant-1') as client:
+        client.accountInfo()
+    pool.call('merchant-2', 'receive', amount=1, currency='USD')
+
+At most maxConcurrent requests are in progress for one account at any
+time, so that a busy account cannot take all the connections.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from coinapult import CoinapultClient, CoinapultError, createSession
+
+
+class _Account(object):
+    def __init__(self, client, limit):
+        self.client = client
+        self.limit = limit
+        self.active = 0
+        self.lastUsed = time.time()
+
+
+class ClientPool(object):
+    def __init__(self, baseURL='https://api.coinapult.com', session=None,
+                 maxConcurrent=4, maxClients=256, idleTimeout=300,
+                 poolConnections=10, poolMaxsize=32, poolBlock=True,
+                 **clientKwargs):
+        """
+        :param str baseURL: base URL for the API server
+        :param requests.Session session: HTTP session shared by every
+            client. If not specified, one is created with createSession
+            and closed by close()
+        :param int maxConcurrent: default limit of requests in progress
+            per account
+        :param int maxClients: number of idle clients kept. The least
+            recently used are dropped first
+        :param idleTimeout: seconds after which an idle client is
+            dropped. Its account stays registered
+        :param int poolConnections: see createSession
+        :param int poolMaxsize: see createSession
+        :param bool poolBlock: see createSession
+        :param clientKwargs: other CoinapultClient parameters used for
+            every client, such as timeout or retry
+        """
+        self.baseURL = baseURL
+        self.maxConcurrent = maxConcurrent
+        self.maxClients = maxClients
+        self.idleTimeout = idleTimeout
+        self.clientKwargs = clientKwargs
+        self._ownSession = session is None
+        if session is None:
+            session = createSession(poolConnections, poolMaxsize, poolBlock)
+        self.session = session
+
+        self._cond = threading.Condition()
+        # Registered accounts, name -> CoinapultClient parameters.
+        self._registered = {}
+        # Clients created, least recently used first.
+        self._accounts = OrderedDict()
+
+    def register(self, name, credentials=None, ecc=None, authmethod=None,
+                 maxConcurrent=None):
+        """
+        Add an account, or replace the keys of an existing one. The
+        parameters are those of CoinapultClient.
+
+        :param int maxConcurrent: limit of requests in progress for
+            this account, instead of the pool default
+        """
+        with self._cond:
+            self._registered[name] = {
+                'credentials': credentials, 'ecc': ecc,
+                'authmethod': authmethod,
+                'maxConcurrent': maxConcurrent or self.maxConcurrent}
+            dropped = self._drop(name)
+        if dropped is not None:
+            dropped.close()
+
+    def unregister(self, name):
+        with self._cond:
+            self._registered.pop(name, None)
+            dropped = self._drop(name)
+        if dropped is not None:
+            dropped.close()
+
+    def __contains__(self, name):
+        return name in self._registered
+
+    def __len__(self):
+        """Number of clients currently kept."""
+        return len(self._accounts)
+
+    def active(self, name):
+        """Return the number of requests in progress for an account."""
+        account = self._accounts.get(name)
+        return account.active if account is not None else 0
+
+    @contextmanager
+    def acquire(self, name, timeout=None):
+        """
+        Return a context manager giving the client of an account, once
+        fewer than its limit of requests are in progress.
+
+        :param timeout: seconds to wait for the limit, None waits forever
+        :raises CoinapultError: if the account is not registered or the
+            timeout expires
+        """
+        account = self._checkout(name, timeout)
+        try:
+            yield account.client
+        finally:
+            self._checkin(name, account)
+
+    def call(self, name, method, *args, **kwargs):
+        """Call a CoinapultClient method for an account, e.g. 'receive'."""
+        with self.acquire(name) as client:
+            return getattr(client, method)(*args, **kwargs)
+
+    def evict(self):
+        """Drop the clients idle for too long or in excess of maxClients."""
+        with self._cond:
+            dropped = self._evict()
+        for client in dropped:
+            client.close()
+
+    def close(self):
+        with self._cond:
+            accounts, self._accounts = self._accounts, OrderedDict()
+        for account in accounts.values():
+            account.client.close()
+        if self._ownSession and self.session is not None:
+            self.session.close()
+        self.session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _checkout(self, name, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while True:
+                account = self._account(name)
+                if account.active < account.limit:
+                    break
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise CoinapultError(
+                            "too many requests in progress for %s" % name)
+                self._cond.wait(remaining)
+            account.active += 1
+            # Keep the OrderedDict in least recently used order.
+            del self._accounts[name]
+            self._accounts[name] = account
+        return account
+
+    def _checkin(self, name, account):
+        with self._cond:
+            account.active -= 1
+            account.lastUsed = time.time()
+            self._cond.notify_all()
+            dropped = self._evict()
+            if not account.active and self._accounts.get(name) is not account:
+                # Replaced or unregistered while in use.
+                dropped.append(account.client)
+        for client in dropped:
+            client.close()
+
+    def _account(self, name):
+        account = self._accounts.get(name)
+        if account is not None:
+            return account
+        config = self._registered.get(name)
+        if config is None:
+            raise CoinapultError("unknown account %s" % name)
+        # The ECC keys are parsed by the client when first used.
+        client = CoinapultClient(
+            credentials=config['credentials'], ecc=config['ecc'],
+            authmethod=config['authmethod'], baseURL=self.baseURL,
+            session=self.session, **self.clientKwargs)
+        account = _Account(client, config['maxConcurrent'])
+        self._accounts[name] = account
+        return account
+
+    def _drop(self, name):
+        account = self._accounts.get(name)
+        if account is None:
+            return None
+        del self._accounts[name]
+        # Woken waiters create a client with the new keys.
+        self._cond.notify_all()
+        return account.client if not account.active else None
+
+    def _evict(self):
+        dropped = []
+        expired = time.time() - self.idleTimeout
+        excess = len(self._accounts) - self.maxClients
+        for name, account in self._accounts.items():
+            if account.active:
+                continue
+            if excess > 0 or account.lastUsed < expired:
+                del self._accounts[name]
+                dropped.append(account.client)
+                excess -= 1
+            else:
+                break
+        return dropped
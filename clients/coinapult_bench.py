@@ -0,0 +1,236 @@
+"""
+Offline benchmarks for the Coinapult Python client.
+
+Results are printed as JSON. Usage:
+
+    python coinapult_bench.py import [--runs N]
+    python coinapult_bench.py envelope [--sizes 1,10,100] [--baseline FILE]
+
+The envelope benchmark measures each stage of signing a request
+(json.dumps, base64, HMAC or ECDSA) and of decoding an ECC signed
+response (base64, ECDSA verification, json.loads), as well as the
+complete envelopes. Payloads are search pages holding the given number
+of transactions. When a previous result is given with --baseline, the
+command fails if any benchmark got slower than --threshold times.
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import platform
+import subprocess
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Run in a fresh interpreter: import the client, build a signed HMAC
+# request and check whether ecdsa got imported along the way.
+IMPORT_PROBE = """
+import sys, time, json
+start = time.time()
+import coinapult
+imported = time.time() - start
+afterImport = 'ecdsa' in sys.modules
+client = coinapult.CoinapultClient(credentials={'key': 'k', 'secret': 's'})
+client._signRequest('/api/t/search/', {'transaction_id': 'x'})
+coinapult.generateHmac('data', 'secret')
+print json.dumps({'seconds': imported, 'ecdsaAfterImport': afterImport,
+                  'ecdsaAfterHmac': 'ecdsa' in sys.modules})
+"""
+
+
+def benchImport(runs):
+    """
+    Measure the time taken to import coinapult in a new interpreter,
+    and check that ecdsa is not imported by the HMAC path.
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, [HERE, env.get('PYTHONPATH')]))
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+
+    samples = []
+    ecdsaImported = False
+    for _ in range(runs):
+        out = subprocess.check_output([sys.executable, '-c', IMPORT_PROBE],
+                                      env=env)
+        probe = json.loads(out)
+        samples.append(probe['seconds'])
+        ecdsaImported |= probe['ecdsaAfterImport'] or probe['ecdsaAfterHmac']
+
+    samples.sort()
+    return {
+        'benchmark': 'import',
+        'runs': runs,
+        'min': samples[0],
+        'median': samples[len(samples) // 2],
+        'max': samples[-1],
+        'ecdsaImported': ecdsaImported,
+    }
+
+
+# Fixed keys, so that runs are comparable.
+CLIENT_SECRET_EXPONENT = 0xc0ffee1234567890c0ffee1234567890c0ffee1234567890c0ffee12345678
+SERVER_SECRET_EXPONENT = 0xfeedc0de1234567890feedc0de1234567890feedc0de1234567890feedc0de
+CREDENTIALS = {'key': 'benchmark-key', 'secret': 'benchmark-secret' * 4}
+
+
+def makePayload(records):
+    """Return something shaped like a page from search(many=True)."""
+    transaction = {
+        'type': 'invoice', 'transaction_id': 'a1b2c3d4e5f6a7b8c9d0',
+        'address': '1BenchmarkAddressXXXXXXXXXXXXXXXXX',
+        'timestamp': 1400000000, 'completeTime': 1400000600,
+        'expiration': 1400000900, 'state': 'complete', 'extOID': 'order-1',
+        'in': {'amount': '0.01234567', 'currency': 'BTC', 'expected': None},
+        'out': {'amount': '5.55', 'currency': 'USD', 'expected': '5.55'},
+        'quote': {'bid': '450.01', 'ask': '451.99'},
+    }
+    return {'result': [transaction] * records, 'page': 1, 'pageCount': 1}
+
+
+def timeit(func, minTime=0.2, repeat=3):
+    """Return (best seconds per call, iterations per repeat) for func."""
+    iterations = 1
+    while True:
+        start = time.time()
+        for _ in xrange(iterations):
+            func()
+        elapsed = time.time() - start
+        if elapsed >= minTime / 10 or iterations >= 1 << 20:
+            break
+        iterations *= 2
+    iterations = max(1, int(iterations * minTime / max(elapsed, 1e-9)))
+
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        for _ in xrange(iterations):
+            func()
+        perCall = (time.time() - start) / iterations
+        best = perCall if best is None else min(best, perCall)
+    return best, iterations
+
+
+def benchEnvelope(sizes, minTime):
+    """Benchmark every stage of the request and response envelopes."""
+    import coinapult
+    ecdsa = coinapult.loadECDSA()
+
+    clientKey = ecdsa.SigningKey.from_secret_exponent(
+        CLIENT_SECRET_EXPONENT, curve=ecdsa.SECP256k1)
+    serverKey = ecdsa.SigningKey.from_secret_exponent(
+        SERVER_SECRET_EXPONENT, curve=ecdsa.SECP256k1)
+    client = coinapult.CoinapultClient(credentials=CREDENTIALS, ecc={
+        'privkey': clientKey.to_pem(),
+        'pubkey': clientKey.get_verifying_key().to_pem()})
+    client._loadECC()
+    # Responses are signed by the stand-in server key instead.
+    serverPub = coinapult.precomputedKey(serverKey.get_verifying_key())
+    coinapult.ECC_COINAPULT_PUBKEY = serverPub
+
+    results = []
+    for records in sizes:
+        values = makePayload(records)
+        dumped = json.dumps(values)
+        encoded = base64.b64encode(dumped)
+        hmacSign = coinapult.generateHmac(encoded, client.secret)
+        eccSign = coinapult.generateECCsign(encoded, serverKey)
+        response = {'sign': eccSign, 'data': encoded}
+
+        def receiveECC():
+            coinapult.ECC_VERIFY_CACHE.clear()
+            client._receiveECC(response)
+
+        cases = [
+            ('stage.json.dumps', lambda: json.dumps(values)),
+            ('stage.b64encode', lambda: base64.b64encode(dumped)),
+            ('stage.hmac.sign',
+             lambda: coinapult.generateHmac(encoded, client.secret)),
+            ('stage.hmac.verify',
+             lambda: client.authenticateCallback(client.key, hmacSign,
+                                                 encoded)),
+            ('stage.ecc.sign',
+             lambda: coinapult.generateECCsign(encoded, client.ecc['privkey'])),
+            ('stage.b64decode', lambda: base64.b64decode(encoded)),
+            ('stage.ecc.verify',
+             lambda: coinapult.verifyECCsign(eccSign, encoded, serverPub)),
+            ('stage.json.loads', lambda: json.loads(dumped)),
+            ('request.hmac',
+             lambda: client._signRequest('/api/t/search/', dict(values))),
+            ('request.ecc',
+             lambda: client._signECC('/api/t/search/', dict(values))),
+            ('response.ecc', receiveECC),
+            ('response.ecc.cached', lambda: client._receiveECC(response)),
+        ]
+        for name, func in cases:
+            perCall, iterations = timeit(func, minTime)
+            results.append({
+                'name': name,
+                'records': records,
+                'payloadBytes': len(dumped),
+                'seconds': perCall,
+                'opsPerSecond': 1 / perCall if perCall else None,
+                'iterations': iterations,
+            })
+
+    return {
+        'benchmark': 'envelope',
+        'python': platform.python_version(),
+        'ecdsa': getattr(ecdsa, '__version__', None),
+        'coinapult': coinapult.__version__,
+        'results': results,
+    }
+
+
+def compareBaseline(result, baseline, threshold):
+    """
+    Return the benchmarks that are more than threshold times slower
+    than in baseline.
+    """
+    previous = dict(((item['name'], item['records']), item['seconds'])
+                    for item in baseline['results'])
+    slower = []
+    for item in result['results']:
+        before = previous.get((item['name'], item['records']))
+        if before and item['seconds'] > before * threshold:
+            slower.append({'name': item['name'], 'records': item['records'],
+                           'ratio': item['seconds'] / before})
+    return slower
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    commands = parser.add_subparsers(dest='command')
+    cmd = commands.add_parser('import', help='module import time')
+    cmd.add_argument('--runs', type=int, default=10)
+    cmd = commands.add_parser('envelope', help='request/response envelopes')
+    cmd.add_argument('--sizes', default='1,10,100',
+                     help='comma separated numbers of transactions per payload')
+    cmd.add_argument('--min-time', type=float, default=0.2,
+                     help='approximate seconds spent on each measurement')
+    cmd.add_argument('--baseline', help='JSON output of a previous run')
+    cmd.add_argument('--threshold', type=float, default=1.25)
+    options = parser.parse_args(args)
+
+    if options.command == 'import':
+        result = benchImport(options.runs)
+        print json.dumps(result, indent=2, sort_keys=True)
+        # Importing ecdsa on the HMAC path is a regression.
+        return 1 if result['ecdsaImported'] else 0
+
+    if options.command == 'envelope':
+        sizes = [int(size) for size in options.sizes.split(',')]
+        result = benchEnvelope(sizes, options.min_time)
+        if options.baseline:
+            with open(options.baseline) as baseline:
+                result['regressions'] = compareBaseline(
+                    result, json.load(baseline), options.threshold)
+        print json.dumps(result, indent=2, sort_keys=True)
+        return 1 if result.get('regressions') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""
+WSGI application for receiving transaction callbacks from Coinapult.
+
+Callbacks are POSTed with the signed message in the form field 'data'
+(base64 encoded JSON) and either the headers cpt-key and cpt-hmac, or
+the header cpt-ecc-sign when the account uses ECC. For example:
+
+    from coinapult import CoinapultClient
+    from coinapult_callback import CallbackReceiver
+
+    def handler(payload):
+        print payload['transaction_id'], payload['state']
+
+    client = CoinapultClient(credentials={'key': ..., 'secret': ...})
+    application = CallbackReceiver(client, handler)
+"""
+
+import json
+import base64
+import Queue
+import threading
+from hashlib import sha256
+from urlparse import parse_qs
+
+from coinapult import Future, LRUCache, ECCVerifyingPool, CoinapultErrorECC
+
+
+class CallbackReceiver(object):
+    def __init__(self, client, handler, handlers=1, maxPending=10000,
+                 dedupeSize=100000, onError=None, waitForHandler=False,
+                 eccProcesses=None):
+        """
+        Receive callbacks, authenticate them with client and pass the
+        decoded payloads to handler.
+
+        A callback is answered with 200 only once its signature was
+        checked and its payload queued for the handler threads; forged
+        ones get 403. When maxPending callbacks are already waiting,
+        new ones are answered with 503 so that Coinapult delivers them
+        again later. ECC signatures are checked in a pool of
+        eccProcesses worker processes, while the request thread waits,
+        so that pure Python ECDSA does not hold the GIL of the server.
+
+        By default handler runs after the answer, so a callback is
+        handled at most once: if handler raises, or the process stops
+        with callbacks still queued, Coinapult does not deliver them
+        again. Use a handler that only stores the payload durably, or
+        set waitForHandler, for which the answer waits for handler and
+        is 500 if it raises, so that Coinapult delivers the callback
+        again.
+
+        Callbacks for a (transaction_id, state) pair that was already
+        accepted are answered with 200 and dropped. The last dedupeSize
+        pairs are remembered. If handler raises, the pair is forgotten
+        so that a redelivery is handled again.
+
+        :param CoinapultClient client: client used to authenticate
+            the callbacks
+        :param handler: called with each decoded payload
+        :param int handlers: threads calling handler
+        :param onError: if specified, called with (payload, exception)
+            when handler raises
+        :param bool waitForHandler: answer only once handler returned
+        :param int eccProcesses: processes verifying ECC signatures,
+            the number of CPUs by default. With 0, they are verified
+            in the request thread
+        """
+        self.client = client
+        self.handler = handler
+        self.onError = onError
+        self.maxPending = maxPending
+        self.waitForHandler = waitForHandler
+        self.stats = {'received': 0, 'rejected': 0, 'busy': 0,
+                      'duplicate': 0, 'handled': 0, 'failed': 0}
+
+        self._verifier = None
+        if eccProcesses != 0:
+            self._verifier = ECCVerifyingPool(eccProcesses)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._seen = LRUCache(dedupeSize)
+        self._queue = Queue.Queue()
+        self._handlers = []
+        for _ in range(handlers):
+            thread = threading.Thread(target=self._handle)
+            thread.daemon = True
+            thread.start()
+            self._handlers.append(thread)
+
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD') != 'POST':
+            return self._reply(start_response, '405 Method Not Allowed')
+
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        form = parse_qs(environ['wsgi.input'].read(length))
+        data = form.get('data', [None])[0]
+        key = environ.get('HTTP_CPT_KEY')
+        sign = environ.get('HTTP_CPT_HMAC')
+        if key is None:
+            sign = environ.get('HTTP_CPT_ECC_SIGN')
+        if not data or not sign:
+            return self._reply(start_response, '400 Bad Request')
+
+        try:
+            if key is None and self._verifier is not None:
+                if not self._verifier.verify(sign, data,
+                                             self.client.coinapultPub):
+                    raise CoinapultErrorECC('ECC signature does not match')
+            else:
+                self.client.authenticateCallback(key, sign, data)
+            payload = json.loads(base64.b64decode(data))
+        except Exception:
+            # Bad signatures raise either CoinapultError or, from
+            # ecdsa, BadSignatureError.
+            self._count('rejected')
+            return self._reply(start_response, '403 Forbidden')
+
+        if isinstance(payload, dict) and 'transaction_id' in payload:
+            seenKey = (payload['transaction_id'], payload.get('state'))
+        else:
+            seenKey = sha256(data).digest()
+        with self._lock:
+            if seenKey in self._seen:
+                self.stats['duplicate'] += 1
+                status = 'duplicate'
+            elif self._pending >= self.maxPending:
+                self.stats['busy'] += 1
+                status = 'busy'
+            else:
+                self._seen.put(seenKey, True)
+                self._pending += 1
+                self.stats['received'] += 1
+                status = 'accepted'
+        if status == 'duplicate':
+            return self._reply(start_response, '200 OK')
+        if status == 'busy':
+            return self._reply(start_response, '503 Service Unavailable',
+                               [('Retry-After', '1')])
+
+        done = Future() if self.waitForHandler else None
+        self._queue.put((seenKey, payload, done))
+        if done is not None and done.exception() is not None:
+            return self._reply(start_response, '500 Internal Server Error')
+        return self._reply(start_response, '200 OK')
+
+    def _reply(self, start_response, status, headers=()):
+        body = json.dumps({'status': status.split(' ', 1)[1]})
+        start_response(status, [('Content-Type', 'application/json'),
+                                ('Content-Length', str(len(body)))] +
+                       list(headers))
+        return [body]
+
+    def _count(self, name, done=False):
+        with self._lock:
+            self.stats[name] += 1
+            if done:
+                self._pending -= 1
+
+    def _handle(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            seenKey, payload, done = item
+            try:
+                self.handler(payload)
+            except Exception, err:
+                with self._lock:
+                    self._seen.pop(seenKey)
+                self._count('failed', done=True)
+                if done is not None:
+                    done.setException()
+                if self.onError is not None:
+                    self.onError(payload, err)
+            else:
+                self._count('handled', done=True)
+                if done is not None:
+                    done.setResult(None)
+
+    def pending(self):
+        """Number of accepted callbacks not yet handled."""
+        return self._pending
+
+    def close(self):
+        """
+        Finish handling the accepted callbacks and stop the threads
+        and processes.
+        """
+        for _ in self._handlers:
+            self._queue.put(None)
+        for thread in self._handlers:
+            thread.join()
+        self._handlers = []
+        if self._verifier is not None:
+            self._verifier.close()
+            self._verifier = None
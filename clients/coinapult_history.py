@@ -0,0 +1,183 @@
+"""
+Historical ticker data from Coinapult as a compact time series.
+
+fetchHistory splits a long range into chunks, requests them
+concurrently with getTicker(begin=..., end=...) and keeps only the
+timestamps, bids and asks, in arrays of doubles. For example:
+
+    from coinapult import CoinapultClient
+    from coinapult_history import fetchHistory, TickerSeries
+
+    series = fetchHistory(CoinapultClient(), begin, end, market='USD_BTC')
+    hourly = series.resample(3600)
+    hourly.save('usd_btc.series')
+    ...
+    series = TickerSeries.load('usd_btc.series')
+"""
+
+import mmap
+import array
+import struct
+import bisect
+from multiprocessing.pool import ThreadPool
+
+numpy = None
+try:
+    import numpy
+except ImportError:
+    pass
+
+# File layout: header, then the times, bids and asks as native doubles.
+MAGIC = 'CPTS'
+HEADER = struct.Struct('<4sHQ')
+VERSION = 1
+
+
+class TickerSeries(object):
+    def __init__(self, times=None, bids=None, asks=None):
+        """
+        Bids and asks indexed by time, which must be sorted ascending.
+        Any sequences of floats work; the arrays from fetchHistory are
+        array.array('d'), those from load may be numpy arrays.
+        """
+        self.times = times if times is not None else array.array('d')
+        self.bids = bids if bids is not None else array.array('d')
+        self.asks = asks if asks is not None else array.array('d')
+
+    def __len__(self):
+        return len(self.times)
+
+    def __iter__(self):
+        """Iterate over (time, bid, ask) tuples."""
+        return iter(zip(self.times, self.bids, self.asks))
+
+    def at(self, when):
+        """Return the (time, bid, ask) in effect at the given time, or None."""
+        index = bisect.bisect_right(self.times, when) - 1
+        if index < 0:
+            return None
+        return self.times[index], self.bids[index], self.asks[index]
+
+    def slice(self, begin=None, end=None):
+        """Return the part of the series with begin <= time < end."""
+        start = 0 if begin is None else bisect.bisect_left(self.times, begin)
+        stop = len(self) if end is None else bisect.bisect_left(self.times, end)
+        return TickerSeries(self.times[start:stop], self.bids[start:stop],
+                            self.asks[start:stop])
+
+    def resample(self, interval, how='last'):
+        """
+        Return a series with one point per interval seconds, timestamped
+        at the start of the interval, holding either the last value seen
+        in it or the mean of its values. Empty intervals are skipped.
+
+        :param str how: 'last' or 'mean'
+        """
+        if how not in ('last', 'mean'):
+            raise ValueError("how must be 'last' or 'mean'")
+        result = TickerSeries()
+        bucket, count, bid, ask = None, 0, 0.0, 0.0
+        for when, curBid, curAsk in zip(self.times, self.bids, self.asks):
+            start = when - when % interval
+            if start != bucket:
+                if count:
+                    result._append(bucket, bid / count, ask / count)
+                bucket, count, bid, ask = start, 0, 0.0, 0.0
+            if how == 'last':
+                count, bid, ask = 1, curBid, curAsk
+            else:
+                count, bid, ask = count + 1, bid + curBid, ask + curAsk
+        if count:
+            result._append(bucket, bid / count, ask / count)
+        return result
+
+    def _append(self, when, bid, ask):
+        self.times.append(when)
+        self.bids.append(bid)
+        self.asks.append(ask)
+
+    def extend(self, other):
+        """Append the points of other that are newer than this series."""
+        start = 0
+        if len(self):
+            start = bisect.bisect_right(other.times, self.times[-1])
+        for index in xrange(start, len(other)):
+            self._append(other.times[index], other.bids[index],
+                         other.asks[index])
+
+    def save(self, path):
+        with open(path, 'wb') as out:
+            out.write(HEADER.pack(MAGIC, VERSION, len(self)))
+            for column in (self.times, self.bids, self.asks):
+                array.array('d', column).tofile(out)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a series written by save. With numpy, the columns are
+        memory-mapped from the file instead of being read into memory.
+        """
+        with open(path, 'rb') as source:
+            magic, version, count = HEADER.unpack(source.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("%s is not a ticker series file" % path)
+            if numpy is not None:
+                columns = [numpy.memmap(path, dtype='=f8', mode='r',
+                                        offset=HEADER.size + 8 * count * i,
+                                        shape=(count,)) for i in range(3)]
+                return cls(*columns)
+            if not count:
+                return cls()
+            mapped = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                columns = []
+                for i in range(3):
+                    start = HEADER.size + 8 * count * i
+                    column = array.array('d')
+                    column.fromstring(mapped[start:start + 8 * count])
+                    columns.append(column)
+            finally:
+                mapped.close()
+            return cls(*columns)
+
+
+def parseTicker(response):
+    """Convert a getTicker(begin=..., end=...) response to a series."""
+    points = sorted((item['updatetime'], float(item['bid']), float(item['ask']))
+                    for item in response.get('result', ()))
+    series = TickerSeries()
+    for when, bid, ask in points:
+        if not len(series) or when > series.times[-1]:
+            series._append(when, bid, ask)
+    return series
+
+
+def fetchHistory(client, begin, end, market=None, chunk=86400, concurrency=4):
+    """
+    Fetch the ticker history between the timestamps begin and end.
+
+    :param CoinapultClient client:
+    :param int chunk: seconds covered by each request
+    :param int concurrency: number of requests in flight
+    :rtype TickerSeries:
+    """
+    ranges = [(start, min(start + chunk, end))
+              for start in xrange(int(begin), int(end), int(chunk))]
+
+    def fetch(bounds):
+        return parseTicker(client.getTicker(begin=bounds[0], end=bounds[1],
+                                            market=market))
+
+    series = TickerSeries()
+    if not ranges:
+        return series
+    pool = ThreadPool(max(1, min(concurrency, len(ranges))))
+    try:
+        # Chunks arrive in order and are merged as they do, so only
+        # the parsed arrays are kept.
+        for part in pool.imap(fetch, ranges):
+            series.extend(part)
+    finally:
+        pool.terminate()
+        pool.join()
+    return series
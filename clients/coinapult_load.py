@@ -0,0 +1,227 @@
+"""
+Load generator for the Coinapult Python client.
+
+Calls send, receive, search and getTicker from several threads through
+one CoinapultClient, and prints the throughput and latency percentiles
+per operation as JSON. Usage:
+
+    python coinapult_load.py [--config mock.json] [--concurrency 16]
+        [--duration 30 | --requests N] [--mix receive=3,search=4,...]
+        [--auth creds|ecc] [--latency S] [--error-rate F]
+
+Without --config, a coinapult_mock.MockCoinapult is started in the
+same process, with the given latency and error rate. With it, the
+client is set up from the JSON file written by coinapult_mock.py.
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from multiprocessing.pool import ThreadPool
+
+from coinapult import CoinapultClient, RetryPolicy
+
+DEFAULT_MIX = 'send=1,receive=2,search=4,getTicker=3'
+PERCENTILES = (50, 90, 99)
+
+
+def parseMix(mix):
+    """Parse 'op=weight,...' into a list of (operation, weight)."""
+    result = []
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError("unknown operation %s" % name)
+        result.append((name, float(weight or 1)))
+    return result
+
+
+class LoadRun(object):
+    def __init__(self, client, mix, seed=None):
+        self.client = client
+        self.mix = mix
+        self.random = random.Random(seed)
+        self.transactions = []
+        self.latencies = dict((name, []) for name, _ in mix)
+        self.errors = {}
+        self._lock = threading.Lock()
+        self._total = sum(weight for _, weight in mix)
+
+    def choose(self):
+        with self._lock:
+            point = self.random.uniform(0, self._total)
+        for name, weight in self.mix:
+            point -= weight
+            if point <= 0:
+                return name
+        return self.mix[-1][0]
+
+    def call(self, name):
+        start = time.time()
+        error = None
+        try:
+            result = OPERATIONS[name](self)
+        except Exception, err:
+            error = '%s.%s' % (name, err.__class__.__name__)
+        elapsed = time.time() - start
+        with self._lock:
+            if error is None:
+                self.latencies[name].append(elapsed)
+                if isinstance(result, dict) and 'transaction_id' in result:
+                    self.transactions.append(result['transaction_id'])
+            else:
+                self.errors[error] = self.errors.get(error, 0) + 1
+
+    def randomTransaction(self):
+        with self._lock:
+            if not self.transactions:
+                return None
+            return self.random.choice(self.transactions)
+
+    def run(self, concurrency, duration=None, requests=None):
+        """Run until duration seconds have passed or requests were made."""
+        deadline = None if duration is None else time.time() + duration
+        counter = [0]
+        counterLock = threading.Lock()
+
+        def worker(_):
+            while deadline is None or time.time() < deadline:
+                if requests is not None:
+                    with counterLock:
+                        if counter[0] >= requests:
+                            return
+                        counter[0] += 1
+                self.call(self.choose())
+
+        pool = ThreadPool(concurrency)
+        start = time.time()
+        try:
+            pool.map(worker, range(concurrency))
+        finally:
+            pool.terminate()
+            pool.join()
+        return self.report(time.time() - start)
+
+    def report(self, seconds):
+        operations = {}
+        completed = 0
+        for name, samples in self.latencies.items():
+            samples = sorted(samples)
+            completed += len(samples)
+            stats = {'count': len(samples)}
+            if samples:
+                stats['mean'] = sum(samples) / len(samples)
+                stats['max'] = samples[-1]
+                for q in PERCENTILES:
+                    index = min(len(samples) - 1, int(q / 100.0 * len(samples)))
+                    stats['p%d' % q] = samples[index]
+            operations[name] = stats
+        failed = sum(self.errors.values())
+        return {
+            'seconds': seconds,
+            'completed': completed,
+            'failed': failed,
+            'throughput': completed / seconds if seconds else None,
+            'errors': self.errors,
+            'operations': operations,
+        }
+
+
+def _send(run):
+    return run.client.send(amount=0.001, address='1LoadTestAddress',
+                           currency='BTC')
+
+
+def _receive(run):
+    return run.client.receive(amount=run.random.choice([1, 5, 20]),
+                              currency='USD', outCurrency='BTC')
+
+
+def _search(run):
+    transactionId = run.randomTransaction()
+    if transactionId is None:
+        return run.client.search(typ='invoice', many=True)
+    return run.client.search(transaction_id=transactionId)
+
+
+def _getTicker(run):
+    return run.client.getTicker(market='USD_BTC')
+
+
+OPERATIONS = {
+    'send': _send,
+    'receive': _receive,
+    'search': _search,
+    'getTicker': _getTicker,
+}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--config', help='JSON file from coinapult_mock.py')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds to run, unless --requests is given')
+    parser.add_argument('--requests', type=int, help='number of calls')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help='relative weights of the operations')
+    parser.add_argument('--auth', choices=['creds', 'ecc'], default='creds')
+    parser.add_argument('--retry', type=int, default=0,
+                        help='retries of transient failures')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='latency of the in-process stand-in')
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--seed', type=int)
+    options = parser.parse_args(args)
+
+    try:
+        mix = parseMix(options.mix)
+    except ValueError, err:
+        parser.error(str(err))
+
+    mock = None
+    if options.config:
+        with open(options.config) as source:
+            config = json.load(source)
+    else:
+        from coinapult_mock import MockCoinapult
+        import coinapult
+        ecdsa = coinapult.loadECDSA()
+        eccKey = ecdsa.SigningKey.generate(curve=ecdsa.SECP256k1)
+        config = {
+            'credentials': {'key': 'load', 'secret': coinapult.createNonce(64)},
+            'ecc': {'privkey': eccKey.to_pem(),
+                    'pubkey': eccKey.get_verifying_key().to_pem()}}
+        mock = MockCoinapult(config['credentials'], [config['ecc']['pubkey']],
+                             latency=options.latency, jitter=options.jitter,
+                             errorRate=options.error_rate, seed=options.seed)
+        config['baseURL'] = mock.start()
+        config['coinapultPub'] = mock.publicPEM
+
+    client = CoinapultClient(
+        credentials=config['credentials'], ecc=config['ecc'],
+        authmethod=options.auth, baseURL=config['baseURL'],
+        coinapultPub=config.get('coinapultPub'),
+        poolMaxsize=options.concurrency,
+        retry=RetryPolicy(options.retry) if options.retry else None)
+    try:
+        run = LoadRun(client, mix, options.seed)
+        duration = None if options.requests else options.duration
+        result = run.run(options.concurrency, duration, options.requests)
+    finally:
+        client.close()
+        if mock is not None:
+            mock.stop()
+    result.update({'concurrency': options.concurrency, 'auth': options.auth,
+                   'mix': dict(mix)})
+    print json.dumps(result, indent=2, sort_keys=True)
+    return 1 if result['completed'] == 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+"""
+Local SQLite mirror of Coinapult transactions.
+
+Transactions are stored as received from search(many=True) or from
+verified callbacks, indexed by transaction_id, extOID, txhash, type
+and state. For example:
+
+    from coinapult import CoinapultClient
+    from coinapult_mirror import TransactionMirror
+
+    mirror = TransactionMirror(client, 'transactions.db')
+    mirror.sync(typ='invoice')
+    print mirror.search(extOID='order-1')
+
+Use mirror.ingest as the handler of a coinapult_callback.CallbackReceiver
+to keep it current between syncs.
+"""
+
+import json
+import time
+import sqlite3
+import threading
+
+from coinapult import CoinapultError
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    transaction_id TEXT PRIMARY KEY,
+    extOID TEXT,
+    txhash TEXT,
+    type TEXT,
+    state TEXT,
+    inCurrency TEXT,
+    outCurrency TEXT,
+    timestamp INTEGER,
+    data TEXT NOT NULL,
+    stored REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_extOID ON transactions (extOID);
+CREATE INDEX IF NOT EXISTS transactions_txhash ON transactions (txhash);
+CREATE INDEX IF NOT EXISTS transactions_type_state
+    ON transactions (type, state);
+CREATE INDEX IF NOT EXISTS transactions_timestamp ON transactions (timestamp);
+CREATE TABLE IF NOT EXISTS sync (
+    filters TEXT PRIMARY KEY,
+    highWater INTEGER NOT NULL
+);
+"""
+
+# search() parameters answered locally, and the matching columns.
+LOCAL_FILTERS = {
+    'transaction_id': 'transaction_id',
+    'extOID': 'extOID',
+    'txhash': 'txhash',
+    'typ': 'type',
+    'state': 'state',
+}
+
+
+class TransactionMirror(object):
+    def __init__(self, client, path=':memory:', overlap=86400):
+        """
+        :param CoinapultClient client: used for syncing and for remote
+            searches
+        :param str path: SQLite database file
+        :param int overlap: seconds before the high-water mark that are
+            fetched again on every sync, so that recent transactions
+            changing state are updated
+        """
+        self.client = client
+        self.overlap = overlap
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def ingest(self, transaction):
+        """Store or update a transaction as returned by Coinapult."""
+        self.ingestMany([transaction])
+
+    def ingestMany(self, transactions):
+        rows = []
+        now = time.time()
+        for item in transactions:
+            if not isinstance(item, dict) or 'transaction_id' not in item:
+                continue
+            rows.append((
+                item['transaction_id'], item.get('extOID'),
+                item.get('txhash'), item.get('type'), item.get('state'),
+                (item.get('in') or {}).get('currency'),
+                (item.get('out') or {}).get('currency'),
+                item.get('timestamp'), json.dumps(item), now))
+        if not rows:
+            return 0
+        with self._lock:
+            with self._db:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO transactions VALUES "
+                    "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def highWater(self, **filters):
+        """Return the newest timestamp synced with these filters."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT highWater FROM sync WHERE filters = ?",
+                (_filterKey(filters),)).fetchone()
+        return row[0] if row else None
+
+    def sync(self, batch=100, **filters):
+        """
+        Fetch the transactions matching the search() filters that are
+        newer than the previous sync, minus the overlap.
+
+        Pages are assumed to list the newest transactions first, and
+        fetching stops at the first transaction older than that. The
+        first sync fetches everything.
+
+        :rtype int:
+        :return: number of transactions stored
+        """
+        if not filters:
+            raise CoinapultError('no search parameters provided')
+        highWater = self.highWater(**filters)
+        since = None if highWater is None else highWater - self.overlap
+
+        stored, newest, pending = 0, highWater, []
+        results = self.client.iterSearch(**filters)
+        try:
+            for item in results:
+                timestamp = item.get('timestamp')
+                if since is not None and timestamp is not None and \
+                        timestamp < since:
+                    break
+                if timestamp is not None and (newest is None or
+                                              timestamp > newest):
+                    newest = timestamp
+                pending.append(item)
+                if len(pending) >= batch:
+                    stored += self.ingestMany(pending)
+                    pending = []
+        finally:
+            results.close()
+        stored += self.ingestMany(pending)
+
+        if newest is not None:
+            with self._lock:
+                with self._db:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO sync VALUES (?, ?)",
+                        (_filterKey(filters), newest))
+        return stored
+
+    def search(self, refresh=False, many=False, **filters):
+        """
+        Search for transactions like CoinapultClient.search, answering
+        from the mirror when possible.
+
+        The filters transaction_id, extOID, txhash, typ and state, plus
+        currency (matching either side), are answered locally. Other
+        filters, refresh=True, or a single-transaction search that
+        finds nothing locally go to Coinapult, and the results are
+        stored. As Coinapult does not search by state, refresh needs at
+        least one other filter, and a single-transaction search by
+        state goes through every match of the others at Coinapult.
+
+        :rtype: a transaction dict, or a list of them if many is True
+        """
+        local = dict(filters)
+        currency = local.pop('currency', None)
+        remote = (refresh or (not local and currency is None) or
+                  any(name not in LOCAL_FILTERS for name in local))
+
+        if not remote:
+            found = self._query(local, currency, None if many else 1)
+            if many:
+                return found
+            if found:
+                return found[0]
+
+        # Coinapult does not search by state, so filter afterwards.
+        state = filters.pop('state', None)
+        if not filters:
+            raise CoinapultError('state can only be searched in the mirror, '
+                                 'without refresh')
+        if many or state is not None:
+            found = list(self.client.iterSearch(**filters))
+            self.ingestMany(found)
+            found = [item for item in found
+                     if state is None or item.get('state') == state]
+            if many:
+                return found
+            if not found:
+                raise CoinapultError('transaction not found')
+            return found[0]
+        found = self.client.search(**filters)
+        self.ingest(found)
+        return found
+
+    def _query(self, filters, currency, limit):
+        clauses, args = [], []
+        for name, value in sorted(filters.items()):
+            clauses.append('%s = ?' % LOCAL_FILTERS[name])
+            args.append(value)
+        if currency is not None:
+            clauses.append('(inCurrency = ? OR outCurrency = ?)')
+            args.extend([currency, currency])
+        sql = "SELECT data FROM transactions"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY timestamp DESC"
+        if limit:
+            sql += " LIMIT %d" % limit
+        with self._lock:
+            rows = self._db.execute(sql, args).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+def _filterKey(filters):
+    return json.dumps(filters, sort_keys=True)
@@ -0,0 +1,547 @@
+"""
+Local stand-in for the Coinapult API, for testing and load generation.
+
+Signed requests are checked like Coinapult does: the cpt-hmac or
+cpt-ecc-sign of the base64 encoded data, the timestamp, a nonce that
+was not used before, and the endpoint. Responses to account creation
+and activation are signed with the key of the stand-in, whose PEM must
+be passed as coinapultPub to the clients. Latency and errors can be
+injected. For example:
+
+    from coinapult import CoinapultClient
+    from coinapult_mock import MockCoinapult
+
+    mock = MockCoinapult(credentials={'key': 'k', 'secret': 's'},
+                         latency=0.05, errorRate=0.01)
+    url = mock.start()
+    client = CoinapultClient(credentials={'key': 'k', 'secret': 's'},
+                             baseURL=url, coinapultPub=mock.publicPEM)
+
+A ticker stream for coinapult_stream.TickerStream is served at
+STREAM_PATH.
+
+It can also be run on its own, writing what clients need to a JSON
+file:
+
+    python coinapult_mock.py --port 8080 --config mock.json
+"""
+
+import sys
+import json
+import time
+import uuid
+import base64
+import random
+import socket
+import argparse
+import threading
+import SocketServer
+import BaseHTTPServer
+from hashlib import sha256
+from urlparse import urlparse, parse_qs
+
+from coinapult import (TERMS, CoinapultError, LRUCache, loadECDSA,
+                       generateHmac, generateECCsign, verifyECCsign,
+                       createNonce)
+
+# Price of one bitcoin in the currencies known to the stand-in.
+RATES = {'USD': 450.0, 'EUR': 330.0, 'GBP': 270.0, 'CAD': 495.0}
+SPREAD = 0.01
+PAGE_SIZE = 50
+# Path of the streaming ticker, see coinapult_stream.TickerStream.
+STREAM_PATH = '/stream/ticker'
+# Statuses answered before the request is processed; the others are
+# answered after, as if the response was lost.
+UNPROCESSED_STATUS = (429, 503)
+
+
+class MockCoinapult(object):
+    def __init__(self, credentials=None, eccKeys=(), serverKey=None,
+                 latency=0, jitter=0, errorRate=0,
+                 errorStatus=(502, 503, 504), maxSkew=300, seed=None,
+                 streamInterval=1):
+        """
+        :param dict credentials: a single {'key': ..., 'secret': ...}
+            or several as {key: secret}
+        :param eccKeys: PEM public keys of the ECC accounts. Accounts
+            created through account/create are added
+        :param serverKey: ecdsa.SigningKey, or its PEM, for signing
+            responses. A new one is generated if not specified
+        :param latency: seconds added to every response
+        :param jitter: up to this many seconds added on top of latency
+        :param errorRate: fraction of requests answered with one of the
+            HTTP statuses in errorStatus
+        :param maxSkew: seconds of difference accepted between the
+            timestamp of a request and the local clock
+        :param streamInterval: seconds between the tickers sent on
+            STREAM_PATH for each market
+        """
+        ecdsa = loadECDSA()
+        if credentials and 'key' in credentials and 'secret' in credentials:
+            credentials = {credentials['key']: credentials['secret']}
+        self.credentials = dict(credentials or {})
+        self.eccKeys = {}
+        for pem in eccKeys:
+            self.addECCKey(pem)
+        if serverKey is None:
+            serverKey = ecdsa.SigningKey.generate(curve=ecdsa.SECP256k1)
+        elif isinstance(serverKey, basestring):
+            serverKey = ecdsa.SigningKey.from_pem(serverKey)
+        self.serverKey = serverKey
+        self.publicPEM = serverKey.get_verifying_key().to_pem()
+
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.errorStatus = tuple(errorStatus)
+        self.maxSkew = maxSkew
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.streamInterval = streamInterval
+        # Raw lines sent first on every ticker stream connection, e.g.
+        # for testing malformed messages.
+        self.streamPrefix = []
+
+        self._lock = threading.Lock()
+        self._nonces = LRUCache(100000)
+        self._transactions = {}
+        self._extOIDs = {}
+        self._order = []
+        self._server = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+        self.endpoints = {
+            '/api/ticker/': (False, self.ticker),
+            '/api/t/receive/': (True, self.receive),
+            '/api/t/send/': (True, self.send),
+            '/api/t/search/': (True, self.search),
+            '/api/accountInfo/': (True, self.accountInfo),
+            '/api/accountInfo/address': (True, self.accountAddress),
+            '/api/getBitcoinAddress/': (True, self.getBitcoinAddress),
+            '/api/address/config': (True, self.configAddress),
+            '/api/account/create': (True, self.createAccount),
+            '/api/account/activate': (True, self.activateAccount),
+        }
+
+    def addECCKey(self, pem):
+        """Accept requests signed with the ECC key pem; return its hash."""
+        pem = pem.strip()
+        pubhash = sha256(pem).hexdigest()
+        self.eccKeys[pubhash] = loadECDSA().VerifyingKey.from_pem(pem)
+        return pubhash
+
+    def start(self, host='127.0.0.1', port=0):
+        """Serve in a background thread and return the base URL."""
+        self._stopped.clear()
+        self._server = _Server((host, port), _Handler)
+        self._server.mock = self
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return 'http://%s:%d' % self._server.server_address
+
+    def stop(self, timeout=5):
+        """
+        Stop serving, waiting up to timeout seconds for the requests
+        in progress.
+        """
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.closeConnections(timeout)
+            self._server.server_close()
+            self._server = None
+            self._thread.join()
+
+    def handle(self, method, path, form, headers):
+        """
+        Answer a request.
+
+        :param dict form: the query string or form fields, one value each
+        :param headers: a mapping with case insensitive keys
+        :rtype tuple:
+        :return: (HTTP status, dict to send as JSON)
+        """
+        with self._lock:
+            self.requests += 1
+            failure = None
+            if self.errorRate and self.random.random() < self.errorRate:
+                failure = self.random.choice(self.errorStatus)
+            delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+        if failure in UNPROCESSED_STATUS:
+            return failure, {'error': 'injected failure'}
+
+        endpoint = self.endpoints.get(path)
+        if endpoint is None:
+            status, body = 404, {'error': 'unknown endpoint'}
+        else:
+            signed, func = endpoint
+            try:
+                if signed:
+                    values, account = self._authenticate(path, form, headers)
+                    status, body = 200, func(values, account)
+                else:
+                    status, body = 200, func(form)
+            except CoinapultError, err:
+                status, body = 400, {'error': err.error}
+        if failure is not None:
+            return failure, {'error': 'injected failure'}
+        return status, body
+
+    def streamTicker(self, form):
+        """
+        Yield the lines of a ticker stream for the markets in form,
+        until the stand-in stops: a ticker per market every
+        streamInterval seconds, each followed by an empty keep-alive.
+        """
+        markets = (form.get('market') or 'USD_BTC').split(',')
+        for line in list(self.streamPrefix):
+            yield line
+        while not self._stopped.is_set():
+            for market in markets:
+                yield json.dumps(self.ticker({'market': market}))
+            yield ''
+            self._stopped.wait(self.streamInterval)
+
+    def _authenticate(self, path, form, headers):
+        """Check the envelope of a signed request and return its values."""
+        data = form.get('data')
+        if not data:
+            raise CoinapultError('missing data')
+        newKey = None
+        if headers.get('cpt-hmac'):
+            secret = self.credentials.get(headers.get('cpt-key'))
+            if secret is None:
+                raise CoinapultError('unknown key')
+            if generateHmac(data, secret) != headers['cpt-hmac']:
+                raise CoinapultError('invalid signature')
+            account = headers['cpt-key']
+        elif headers.get('cpt-ecc-sign'):
+            if headers.get('cpt-ecc-new'):
+                # Account creation and activation are signed with the
+                # key they are about.
+                if path not in ('/api/account/create',
+                                '/api/account/activate'):
+                    raise CoinapultError('invalid signature')
+                newKey = base64.b64decode(headers['cpt-ecc-new']).strip()
+                pubkey = loadECDSA().VerifyingKey.from_pem(newKey)
+                account = sha256(newKey).hexdigest()
+            else:
+                account = headers.get('cpt-ecc-pub')
+                pubkey = self.eccKeys.get(account)
+                if pubkey is None:
+                    raise CoinapultError('unknown key')
+            try:
+                valid = verifyECCsign(headers['cpt-ecc-sign'], data, pubkey)
+            except Exception:
+                valid = False
+            if not valid:
+                raise CoinapultError('invalid signature')
+        else:
+            raise CoinapultError('request not signed')
+
+        try:
+            values = json.loads(base64.b64decode(data))
+        except (TypeError, ValueError):
+            raise CoinapultError('invalid data')
+        if abs(time.time() - values.get('timestamp', 0)) > self.maxSkew:
+            raise CoinapultError('invalid timestamp')
+        if newKey is not None:
+            values['_pubkey'] = newKey
+            return values, account
+        if values.get('endpoint') != path[4:]:
+            raise CoinapultError('invalid endpoint')
+        nonce = (account, values.get('nonce'))
+        with self._lock:
+            if not values.get('nonce') or nonce in self._nonces:
+                raise CoinapultError('invalid nonce')
+            self._nonces.put(nonce, True)
+        return values, account
+
+    def _sign(self, result):
+        data = base64.b64encode(json.dumps(result))
+        return {'sign': generateECCsign(data, self.serverKey), 'data': data}
+
+    def ticker(self, values):
+        now = int(time.time())
+        market = values.get('market', 'USD_BTC')
+        rate = RATES.get(market.split('_')[0], RATES['USD'])
+        if values.get('begin') is not None:
+            begin = int(float(values['begin']))
+            end = int(float(values.get('end') or now))
+            step = max(60, (end - begin) // 1000)
+            return {'result': [
+                {'updatetime': when, 'bid': rate * (1 - SPREAD),
+                 'ask': rate * (1 + SPREAD)}
+                for when in xrange(begin, end, step)]}
+        ticker = {'index': rate, 'market': market, 'updatetime': now}
+        for tier in ('small', 'medium', 'large', 'vip'):
+            ticker[tier] = {'bid': rate * (1 - SPREAD),
+                            'ask': rate * (1 + SPREAD)}
+        return ticker
+
+    def _transaction(self, account, typ, values, inCurrency, outCurrency):
+        try:
+            amount = float(values.get('amount') or 0)
+            outAmount = float(values.get('outAmount') or 0)
+        except ValueError:
+            raise CoinapultError('invalid amount')
+        if amount <= 0 and outAmount <= 0:
+            raise CoinapultError('invalid amount')
+        rate = _rate(inCurrency, outCurrency)
+        if amount > 0:
+            outAmount = amount * rate
+        else:
+            amount = outAmount / rate
+
+        now = int(time.time())
+        transaction = {
+            'transaction_id': uuid.uuid4().hex, 'type': typ,
+            'state': 'processing', 'timestamp': now, 'completeTime': None,
+            'expiration': now + 900, 'extOID': values.get('extOID'),
+            'address': values.get('address'),
+            'in': {'amount': '%.8f' % amount, 'currency': inCurrency,
+                   'expected': '%.8f' % amount},
+            'out': {'amount': '%.8f' % outAmount, 'currency': outCurrency,
+                    'expected': '%.8f' % outAmount},
+            'quote': {'bid': RATES.get(inCurrency, 1) * (1 - SPREAD),
+                      'ask': RATES.get(inCurrency, 1) * (1 + SPREAD)},
+        }
+        if typ == 'invoice' and not transaction['address']:
+            transaction['address'] = _address()
+        with self._lock:
+            extOID = transaction['extOID']
+            if extOID:
+                if (account, extOID) in self._extOIDs:
+                    raise CoinapultError('extOID already used')
+                self._extOIDs[(account, extOID)] = transaction
+            self._transactions[transaction['transaction_id']] = \
+                (account, transaction)
+            self._order.append((account, transaction))
+        return transaction
+
+    def receive(self, values, account):
+        return self._transaction(account, 'invoice', values,
+                                 values.get('currency', 'BTC'),
+                                 values.get('outCurrency') or
+                                 values.get('currency', 'BTC'))
+
+    def send(self, values, account):
+        if not values.get('address'):
+            raise CoinapultError('address required')
+        return self._transaction(account, 'payment', values, 'BTC',
+                                 values.get('currency', 'BTC'))
+
+    def search(self, values, account):
+        with self._lock:
+            if values.get('transaction_id'):
+                found = self._transactions.get(values['transaction_id'])
+                if found is None or found[0] != account:
+                    raise CoinapultError('transaction not found')
+                matches = [found[1]]
+            else:
+                matches = [item for owner, item in reversed(self._order)
+                           if owner == account]
+        for name, field in (('type', 'type'), ('extOID', 'extOID'),
+                            ('txhash', 'txhash')):
+            if values.get(name) is not None:
+                matches = [item for item in matches
+                           if item.get(field) == values[name]]
+        if values.get('currency') is not None:
+            matches = [item for item in matches
+                       if values['currency'] in (item['in']['currency'],
+                                                 item['out']['currency'])]
+        if not values.get('many'):
+            if not matches:
+                raise CoinapultError('transaction not found')
+            return matches[0]
+        page = max(1, int(values.get('page') or 1))
+        pageCount = max(1, (len(matches) + PAGE_SIZE - 1) // PAGE_SIZE)
+        start = (page - 1) * PAGE_SIZE
+        return {'result': matches[start:start + PAGE_SIZE], 'page': page,
+                'pageCount': pageCount}
+
+    def accountInfo(self, values, account):
+        return {'role': 'merchant', 'balances': [
+            {'currency': currency, 'amount': 1000.0}
+            for currency in ['BTC'] + sorted(RATES)]}
+
+    def accountAddress(self, values, account):
+        return {'address': values.get('address'), 'status': 'valid'}
+
+    def getBitcoinAddress(self, values, account):
+        return {'address': _address()}
+
+    def configAddress(self, values, account):
+        return {'address': values.get('address'), 'status': 'success'}
+
+    def createAccount(self, values, account):
+        pem = values.get('_pubkey')
+        if pem is None:
+            raise CoinapultError('missing public key')
+        with open(TERMS) as terms:
+            termsHash = sha256(terms.read()).hexdigest()
+        self.addECCKey(pem)
+        return self._sign({'success': account, 'terms': termsHash,
+                           'info': 'mock account'})
+
+    def activateAccount(self, values, account):
+        if values.get('hash') != account:
+            raise CoinapultError('unexpected hash')
+        return self._sign({'success': account, 'agree': values.get('agree')})
+
+
+def _rate(inCurrency, outCurrency):
+    """Return how many outCurrency one inCurrency is worth."""
+    def btc(currency):
+        return 1.0 if currency == 'BTC' else 1.0 / RATES[currency]
+    try:
+        return btc(inCurrency) / btc(outCurrency)
+    except KeyError:
+        raise CoinapultError('unsupported currency')
+
+
+def _address():
+    return '1Mock' + createNonce(30)
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address, handler):
+        BaseHTTPServer.HTTPServer.__init__(self, address, handler)
+        self._idle = threading.Condition()
+        self._connections = set()
+
+    def process_request(self, request, clientAddress):
+        with self._idle:
+            self._connections.add(request)
+        SocketServer.ThreadingMixIn.process_request(self, request,
+                                                    clientAddress)
+
+    def process_request_thread(self, request, clientAddress):
+        try:
+            SocketServer.ThreadingMixIn.process_request_thread(
+                self, request, clientAddress)
+        finally:
+            with self._idle:
+                self._connections.discard(request)
+                self._idle.notify_all()
+
+    def closeConnections(self, timeout):
+        """
+        Stop reading from the open connections, so that idle keep-alive
+        ones end, and wait up to timeout seconds for the requests in
+        progress to be answered.
+        """
+        end = time.time() + timeout
+        with self._idle:
+            for request in self._connections:
+                try:
+                    request.shutdown(socket.SHUT_RD)
+                except socket.error:
+                    pass
+            while self._connections and time.time() < end:
+                self._idle.wait(end - time.time())
+
+    def handle_error(self, request, clientAddress):
+        # Clients may go away, e.g. when their deadline expires.
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request,
+                                                   clientAddress)
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send each response in one write, instead of one per header line
+    # delayed by Nagle's algorithm.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == STREAM_PATH:
+            self._stream(url.query)
+        else:
+            self._respond(url.path, url.query)
+
+    def _stream(self, query):
+        form = dict((name, values[0])
+                    for name, values in parse_qs(query).items())
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for line in self.server.mock.streamTicker(form):
+                line += '\n'
+                self.wfile.write('%x\r\n%s\r\n' % (len(line), line))
+                self.wfile.flush()
+            self.wfile.write('0\r\n\r\n')
+        except IOError:
+            # The client went away.
+            pass
+        self.close_connection = 1
+
+    def do_POST(self):
+        length = int(self.headers.get('content-length') or 0)
+        self._respond(urlparse(self.path).path, self.rfile.read(length))
+
+    def _respond(self, path, query):
+        form = dict((name, values[0])
+                    for name, values in parse_qs(query).items())
+        status, result = self.server.mock.handle(self.command, path, form,
+                                                 self.headers)
+        body = json.dumps(result)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--config',
+                        help='write the URL, credentials and keys to this '
+                             'JSON file, for coinapult_load.py')
+    options = parser.parse_args(args)
+
+    ecdsa = loadECDSA()
+    credentials = {'key': createNonce(20), 'secret': createNonce(64)}
+    eccKey = ecdsa.SigningKey.generate(curve=ecdsa.SECP256k1)
+    ecc = {'privkey': eccKey.to_pem(),
+           'pubkey': eccKey.get_verifying_key().to_pem()}
+    mock = MockCoinapult(credentials, [ecc['pubkey']],
+                         latency=options.latency, jitter=options.jitter,
+                         errorRate=options.error_rate)
+    url = mock.start(options.host, options.port)
+    config = {'baseURL': url, 'credentials': credentials, 'ecc': ecc,
+              'coinapultPub': mock.publicPEM}
+    if options.config:
+        with open(options.config, 'w') as out:
+            json.dump(config, out, indent=2)
+    print "Serving on %s" % url
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
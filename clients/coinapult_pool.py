@@ -0,0 +1,328 @@
+"""
+Pre-generated payment addresses and invoices for Coinapult.
+
+A PaymentPool keeps a number of fresh bitcoin addresses, or of open
+invoices for fixed amounts, created ahead of time by a background
+thread, so that checkout does not wait for a round trip to Coinapult.
+For example:
+
+    from coinapult import CoinapultClient
+    from coinapult_pool import PaymentPool
+
+    pool = PaymentPool(client, path='payments.json',
+                       callback='https://shop.example.com/coinapult')
+    pool.addAddresses('btc', low=10, high=50)
+    pool.addInvoices('usd-5', amount=5, currency='USD', low=5, high=20)
+    pool.start()
+    ...
+    address = pool.claim('btc', extOID='order-1')
+    invoice = pool.claim('usd-5', extOID='order-2')
+
+Whenever a kind of item has fewer than low left, it is refilled up to
+high. The pool is saved to path, so that items still available are
+used after a restart. Every claim is appended to path + '.log' before
+the item is handed out, and the background thread compacts the log
+into path.
+"""
+
+import os
+import json
+import time
+import threading
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+from coinapult import CoinapultError
+
+
+class PaymentPool(object):
+    def __init__(self, client, path=None, callback='', interval=30,
+                 minLifetime=600, concurrency=4, keepBindings=7 * 86400):
+        """
+        :param CoinapultClient client:
+        :param str path: JSON file holding the pool between restarts
+        :param str callback: callback URL of the invoices created ahead
+            of time. It can not be changed when one is claimed
+        :param interval: seconds between checks of the watermarks, in
+            addition to the checks made after every claim
+        :param minLifetime: invoices expiring within this many seconds
+            are not handed out anymore
+        :param int concurrency: number of requests made in parallel
+            when refilling
+        :param keepBindings: seconds after which the binding of a
+            claimed item is forgotten
+        """
+        self.client = client
+        self.path = path
+        self.callback = callback
+        self.interval = interval
+        self.minLifetime = minLifetime
+        self.concurrency = concurrency
+        self.keepBindings = keepBindings
+        # extOID and callback of claimed items, by address or
+        # transaction_id.
+        self.bindings = {}
+        self.lastError = None
+
+        self._kinds = {}
+        self._items = {}
+        self._lock = threading.Lock()
+        self._saveLock = threading.Lock()
+        self._dirty = False
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._log = None
+        if path is not None:
+            self._load()
+            self._log = open(path + '.log', 'a')
+            if os.path.getsize(path + '.log') and not self._logEnded:
+                # End a line cut short by a crash, so the next claim
+                # starts on a line of its own.
+                self._log.write('\n')
+
+    def addAddresses(self, name, low=10, high=50):
+        """Keep between low and high unused bitcoin addresses."""
+        self._addKind(name, {'type': 'address'}, low, high)
+
+    def addInvoices(self, name, amount=0, outAmount=0, currency='BTC',
+                    outCurrency=None, low=5, high=20):
+        """
+        Keep between low and high open invoices for the same amount.
+        The parameters are those of CoinapultClient.receive.
+        """
+        self._addKind(name, {'type': 'invoice', 'amount': amount,
+                             'outAmount': outAmount, 'currency': currency,
+                             'outCurrency': outCurrency}, low, high)
+
+    def _addKind(self, name, params, low, high):
+        if not 0 <= low <= high:
+            raise ValueError("expected 0 <= low <= high")
+        with self._lock:
+            kind = dict(params, low=low, high=high)
+            if self._kinds.get(name, kind) != kind:
+                # Items created with other parameters can not be used.
+                self._items[name] = deque()
+                self._dirty = True
+            self._kinds[name] = kind
+            self._items.setdefault(name, deque())
+        self._wake.set()
+
+    def available(self, name):
+        return len(self._items.get(name, ()))
+
+    def start(self):
+        """Refill the pool in a background thread."""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop refilling and save the pool."""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.save()
+
+    def claim(self, name, extOID=None, callback=None):
+        """
+        Take an item out of the pool and bind it to extOID and callback.
+
+        The callback of an address is configured at Coinapult with
+        configAddress, which is one round trip. An invoice keeps the
+        callback of the pool, and the binding is only recorded locally
+        in self.bindings, by transaction_id. If the pool is empty, a new
+        item is created immediately.
+
+        The claim is appended to the log of the pool before the item is
+        returned, so that it is never handed out again after a restart.
+        If configAddress fails, the address is put back into the pool
+        and the error is raised.
+
+        :rtype dict:
+        :return: the response of getBitcoinAddress or receive
+        """
+        kind = self._kinds.get(name)
+        if kind is None:
+            raise CoinapultError("unknown pool %s" % name)
+        item = self._take(name, kind)
+        if item is None:
+            item = self._create(kind)
+        self._wake.set()
+
+        if kind['type'] == 'address':
+            key = item['address']
+            if extOID is not None or callback is not None:
+                config = {}
+                if extOID is not None:
+                    config['extOID'] = extOID
+                if callback is not None:
+                    config['callback'] = callback
+                try:
+                    self.client.configAddress(key, **config)
+                except Exception:
+                    # The address was not handed out, keep it.
+                    with self._lock:
+                        if name in self._items:
+                            self._items[name].appendleft(item)
+                            self._dirty = True
+                    raise
+        else:
+            key = item['transaction_id']
+        binding = {'extOID': extOID, 'callback': callback,
+                   'claimed': time.time()}
+        with self._lock:
+            self.bindings[key] = binding
+            self._dirty = True
+            if self._log is not None:
+                self._log.write(json.dumps(
+                    {'name': name, 'key': key, 'binding': binding}) + '\n')
+                self._log.flush()
+        return item
+
+    def binding(self, key):
+        """Return the binding of a claimed address or transaction_id."""
+        return self.bindings.get(key)
+
+    def _take(self, name, kind):
+        usable = time.time() + self.minLifetime
+        with self._lock:
+            items = self._items[name]
+            while items:
+                item = items.popleft()
+                self._dirty = True
+                if kind['type'] == 'address' or \
+                        item.get('expiration', usable) >= usable:
+                    return item
+        return None
+
+    def _create(self, kind):
+        if kind['type'] == 'address':
+            return self.client.getBitcoinAddress()
+        return self.client.receive(
+            amount=kind['amount'], outAmount=kind['outAmount'],
+            currency=kind['currency'], outCurrency=kind['outCurrency'],
+            callback=self.callback)
+
+    def refill(self):
+        """Refill every kind of item that is below its low watermark."""
+        missing = []
+        now = time.time()
+        with self._lock:
+            for name, kind in self._kinds.items():
+                items = self._items[name]
+                if kind['type'] == 'invoice':
+                    usable = now + self.minLifetime
+                    fresh = deque(item for item in items
+                                  if item.get('expiration', usable) >= usable)
+                    if len(fresh) != len(items):
+                        self._items[name] = items = fresh
+                        self._dirty = True
+                if len(items) < kind['low']:
+                    missing.extend([name] * (kind['high'] - len(items)))
+            expired = now - self.keepBindings
+            for key, binding in self.bindings.items():
+                if binding['claimed'] < expired:
+                    del self.bindings[key]
+                    self._dirty = True
+        if not missing:
+            return 0
+
+        def create(name):
+            try:
+                return name, self._create(self._kinds[name])
+            except (CoinapultError, IOError), err:
+                self.lastError = err
+                return name, None
+
+        created = 0
+        pool = ThreadPool(max(1, min(self.concurrency, len(missing))))
+        try:
+            for name, item in pool.imap_unordered(create, missing):
+                if item is None:
+                    continue
+                with self._lock:
+                    if name in self._items:
+                        self._items[name].append(item)
+                        self._dirty = True
+                created += 1
+        finally:
+            pool.terminate()
+            pool.join()
+        return created
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.clear()
+            try:
+                self.refill()
+            except Exception, err:
+                self.lastError = err
+            self.save()
+            self._wake.wait(self.interval)
+
+    def save(self):
+        """
+        Write the pool to path if it changed, and empty the log of
+        claims, which the file then includes.
+        """
+        if self.path is None:
+            return
+        with self._saveLock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                state = {
+                    'kinds': dict(self._kinds),
+                    'items': dict((name, list(items))
+                                  for name, items in self._items.items()),
+                    'bindings': dict(self.bindings),
+                }
+                self._dirty = False
+                # Claims from now on go to a new log. The old one is
+                # replayed on load until the new state is written.
+                self._log.close()
+                os.rename(self.path + '.log', self.path + '.log.old')
+                self._log = open(self.path + '.log', 'a')
+            temp = '%s.tmp' % self.path
+            with open(temp, 'w') as out:
+                json.dump(state, out)
+            os.rename(temp, self.path)
+            os.remove(self.path + '.log.old')
+
+    def _load(self):
+        if os.path.exists(self.path):
+            with open(self.path) as source:
+                state = json.load(source)
+            self._kinds = state.get('kinds', {})
+            self._items = dict(
+                (name, deque(items))
+                for name, items in state.get('items', {}).items())
+            self.bindings = state.get('bindings', {})
+        self._logEnded = True
+        for path in (self.path + '.log.old', self.path + '.log'):
+            if not os.path.exists(path):
+                continue
+            with open(path) as source:
+                for line in source:
+                    self._logEnded = line.endswith('\n')
+                    try:
+                        claim = json.loads(line)
+                    except ValueError:
+                        # Cut short by a crash while writing.
+                        continue
+                    self._replay(claim['name'], claim['key'],
+                                 claim['binding'])
+
+    def _replay(self, name, key, binding):
+        kind = self._kinds.get(name)
+        if kind is not None and name in self._items:
+            field = 'address' if kind['type'] == 'address' else \
+                'transaction_id'
+            self._items[name] = deque(item for item in self._items[name]
+                                      if item.get(field) != key)
+        self.bindings[key] = binding
+        self._dirty = True
@@ -0,0 +1,140 @@
+"""
+Bulk conversion of fiat prices to bitcoin from one ticker snapshot.
+
+For example, for a catalog priced in several currencies:
+
+    from coinapult import CoinapultClient
+    from coinapult_pricing import snapshotRates, convertPrices
+
+    rates = snapshotRates(CoinapultClient(), set(currencies))
+    btcPrices = convertPrices(amounts, currencies, rates)
+
+Amounts are handled as decimal.Decimal throughout, and results are
+rounded to the requested number of places only at the end.
+"""
+
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from coinapult import CoinapultError
+
+
+class PricingError(CoinapultError):
+    """
+    Raised when some rows of a batch are invalid. errors holds an
+    (index, message) pair for every one of them.
+    """
+
+    def __init__(self, errors):
+        CoinapultError.__init__(self, "%d invalid rows: %s" % (
+            len(errors), "; ".join("row %d: %s" % item for item in errors)))
+        self.errors = errors
+
+
+def toDecimal(amount):
+    """
+    Convert an amount to a Decimal the way validateAmounts reads it,
+    through str, so that floats keep their shortest representation.
+    """
+    if isinstance(amount, Decimal):
+        return amount
+    return Decimal(str(amount).strip())
+
+
+def validateAmountsBatch(amounts):
+    """
+    Check that every amount is a positive number.
+
+    :rtype list:
+    :return: the amounts as Decimals
+    :raises PricingError: listing every invalid row
+    """
+    values, errors = [], []
+    for index, amount in enumerate(amounts):
+        try:
+            value = toDecimal(amount)
+        except (InvalidOperation, ValueError, TypeError):
+            errors.append((index, "amount must be a number"))
+            continue
+        if not value.is_finite():
+            errors.append((index, "amount must be a number"))
+        elif value <= 0:
+            errors.append((index, "amount must be positive"))
+        values.append(value)
+    if errors:
+        raise PricingError(errors)
+    return values
+
+
+def tickerRate(ticker, tier=None, side='bid'):
+    """
+    Return the price of one bitcoin in a ticker from getTicker: the
+    index, or the bid or ask of a tier such as 'small' or 'large'.
+    """
+    if tier is None:
+        return toDecimal(ticker['index'])
+    return toDecimal(ticker[tier][side])
+
+
+def snapshotRates(client, currencies, tier=None, side='bid'):
+    """
+    Fetch the price of one bitcoin in every currency, with one
+    getTicker call per currency.
+
+    :rtype dict:
+    :return: {currency: Decimal}
+    """
+    rates = {}
+    for currency in currencies:
+        if currency == 'BTC':
+            rates[currency] = Decimal(1)
+            continue
+        ticker = client.getTicker(market='%s_BTC' % currency)
+        rates[currency] = tickerRate(ticker, tier, side)
+    return rates
+
+
+def convertPrices(amounts, currencies, rates, places=8,
+                  rounding=ROUND_HALF_UP):
+    """
+    Convert fiat amounts to bitcoin.
+
+    Every row is checked first, and all problems, including
+    currencies without a rate, are reported together.
+
+    :param amounts: sequence of amounts
+    :param currencies: a currency code for all amounts, or a sequence
+        with one per amount
+    :param dict rates: price of one bitcoin per currency, as returned
+        by snapshotRates
+    :param int places: decimal places in the result
+    :rtype list:
+    :return: Decimal bitcoin amounts, in the same order as amounts
+    :raises PricingError:
+    """
+    amounts = list(amounts)
+    if isinstance(currencies, basestring):
+        currencies = [currencies] * len(amounts)
+    else:
+        currencies = list(currencies)
+        if len(currencies) != len(amounts):
+            raise CoinapultError("expected one currency per amount")
+
+    errors = []
+    try:
+        values = validateAmountsBatch(amounts)
+    except PricingError, err:
+        errors, values = err.errors, None
+    prices = {}
+    for currency in set(currencies):
+        rate = rates.get(currency)
+        if rate is not None and toDecimal(rate) > 0:
+            prices[currency] = toDecimal(rate)
+    for index, currency in enumerate(currencies):
+        if currency not in prices:
+            errors.append((index, "no rate for %s" % currency))
+    if errors:
+        raise PricingError(sorted(errors))
+
+    quantum = Decimal(1).scaleb(-places)
+    return [(value / prices[currency]).quantize(quantum, rounding)
+            for value, currency in zip(values, currencies)]
@@ -0,0 +1,172 @@
+"""
+Streaming ticker client.
+
+A TickerStream keeps one long-lived HTTP connection to a streaming
+endpoint and keeps the latest ticker of every market in memory.
+
+The protocol is the one served by coinapult_mock.MockCoinapult at
+coinapult_mock.STREAM_PATH, not a documented Coinapult API: a GET with
+the markets in the query parameter 'market', answered with one JSON
+ticker per line, shaped like the responses from
+CoinapultClient.getTicker (including 'market' and 'updatetime'). Empty
+lines are keep-alives. When the connection drops it is opened again,
+with the last 'updatetime' received in the query parameter 'since' so
+that a server supporting it can send the updates missed. For example:
+
+    from coinapult_mock import MockCoinapult, STREAM_PATH
+    from coinapult_stream import TickerStream
+
+    mock = MockCoinapult(credentials)
+    stream = TickerStream(mock.start() + STREAM_PATH, markets=['USD_BTC'])
+    stream.start()
+    ...
+    print stream.latest('USD_BTC')['index']
+"""
+
+import json
+import Queue
+import random
+import threading
+
+from coinapult import CoinapultError, createSession
+
+
+class TickerStream(object):
+    def __init__(self, url, markets=None, session=None, timeout=(10, 60),
+                 reconnectDelay=1, maxReconnectDelay=30):
+        """
+        :param str url: streaming endpoint speaking the protocol
+            described in this module
+        :param list markets: markets to subscribe to, e.g. ['USD_BTC'].
+            If not specified, the server default is used
+        :param requests.Session session: session used for connecting,
+            a new one is created if not specified
+        :param timeout: (connect, read) timeout in seconds. The read
+            timeout must be longer than the interval between keep-alives
+        :param reconnectDelay: initial delay before connecting again,
+            doubled after each failed attempt up to maxReconnectDelay
+        """
+        self.url = url
+        self.markets = markets
+        self.session = session or createSession(poolConnections=1,
+                                                poolMaxsize=1)
+        self.timeout = timeout
+        self.reconnectDelay = reconnectDelay
+        self.maxReconnectDelay = maxReconnectDelay
+
+        # Latest ticker per market. The dict is never modified, only
+        # replaced, so it can be read from any thread without locking.
+        self.rates = {}
+        self.connects = 0
+        self.lastError = None
+
+        self._since = None
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._response = None
+        self._thread = None
+
+    def start(self):
+        """Connect and keep the rates updated in a background thread."""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Close the connection and wait for the background thread."""
+        self._stopped.set()
+        response = self._response
+        if response is not None:
+            response.close()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def latest(self, market):
+        """Return the latest ticker received for market, or None."""
+        return self.rates.get(market)
+
+    def subscribe(self, maxsize=1000):
+        """
+        Return a Queue.Queue receiving every ticker from now on. If the
+        consumer falls more than maxsize tickers behind, the oldest are
+        discarded.
+        """
+        queue = Queue.Queue(maxsize)
+        with self._lock:
+            self._subscribers = self._subscribers + [queue]
+        return queue
+
+    def unsubscribe(self, queue):
+        with self._lock:
+            self._subscribers = [item for item in self._subscribers
+                                 if item is not queue]
+
+    def _run(self):
+        delay = self.reconnectDelay
+        while not self._stopped.is_set():
+            connects = self.connects
+            try:
+                self._consume()
+            except Exception, err:
+                # Anything, so that the thread never dies silently.
+                self.lastError = err
+            if self._stopped.is_set():
+                break
+            if self.connects != connects:
+                delay = self.reconnectDelay
+            self._stopped.wait(random.uniform(delay / 2.0, delay))
+            delay = min(delay * 2, self.maxReconnectDelay)
+
+    def _consume(self):
+        params = {}
+        if self.markets:
+            params['market'] = ','.join(self.markets)
+        if self._since is not None:
+            params['since'] = self._since
+
+        response = self.session.get(self.url, params=params, stream=True,
+                                    timeout=self.timeout)
+        self._response = response
+        try:
+            response.raise_for_status()
+            self.connects += 1
+            for line in response.iter_lines():
+                if self._stopped.is_set():
+                    break
+                if line:
+                    self._dispatch(json.loads(line))
+        finally:
+            self._response = None
+            response.close()
+
+    def _dispatch(self, ticker):
+        if not isinstance(ticker, dict):
+            # Skipped, the stream itself is still usable.
+            self.lastError = CoinapultError("unexpected message %r" % (
+                ticker,))
+            return
+        if 'error' in ticker:
+            raise CoinapultError(ticker['error'])
+        market = ticker.get('market')
+        if market is None:
+            return
+
+        rates = dict(self.rates)
+        rates[market] = ticker
+        self.rates = rates
+        if ticker.get('updatetime') is not None:
+            self._since = ticker['updatetime']
+
+        for queue in self._subscribers:
+            while True:
+                try:
+                    queue.put_nowait(ticker)
+                    break
+                except Queue.Full:
+                    try:
+                        queue.get_nowait()
+                    except Queue.Empty:
+                        pass
@@ -0,0 +1,249 @@
+"""
+Follow the state of many Coinapult transactions with few requests.
+
+A TransactionWatcher polls the watched transactions of each type
+together, with search(typ=..., many=True), instead of searching for
+each of them. Transactions that changed recently are checked often,
+the others less and less. For example:
+
+    from coinapult import CoinapultClient
+    from coinapult_watcher import TransactionWatcher
+
+    def changed(transaction, previous):
+        print transaction['transaction_id'], previous, transaction['state']
+
+    watcher = TransactionWatcher(client)
+    watcher.start()
+    future = watcher.watch(invoice['transaction_id'], typ='invoice',
+                           callback=changed)
+    print future.result()['state']
+
+Use watcher.feedCallback as the handler of a
+coinapult_callback.CallbackReceiver so that callbacks are seen without
+waiting for the next poll.
+"""
+
+import time
+import threading
+
+from coinapult import CoinapultError, Future
+
+# States after which a transaction does not change anymore.
+FINAL_STATES = frozenset(['complete', 'canceled', 'cancelled', 'expired',
+                          'failed'])
+
+
+class _Watch(object):
+    def __init__(self, transactionId, typ, interval):
+        self.transactionId = transactionId
+        self.typ = typ
+        self.timestamp = None
+        self.state = None
+        self.interval = interval
+        self.nextCheck = 0
+        self.callbacks = []
+        self.future = Future()
+
+
+class TransactionWatcher(object):
+    def __init__(self, client, minInterval=5, maxInterval=300, maxPages=10,
+                 maxSingle=20, finalStates=FINAL_STATES):
+        """
+        :param CoinapultClient client:
+        :param minInterval: seconds between checks of a transaction
+            that just changed. The interval doubles every time it is
+            found unchanged, up to maxInterval
+        :param int maxPages: pages of search results read per type and
+            poll. Transactions not found in them are searched one by one
+        :param int maxSingle: transactions searched one by one per poll
+        :param finalStates: states after which a transaction is not
+            watched anymore
+        """
+        self.client = client
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.maxPages = maxPages
+        self.maxSingle = maxSingle
+        self.finalStates = finalStates
+        self.lastError = None
+        self.requests = 0
+
+        self._watched = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def watch(self, transactionId, typ=None, callback=None):
+        """
+        Watch a transaction until it reaches a final state.
+
+        :param str typ: type of the transaction, as in search. If not
+            specified, it is found with a first search by transaction_id
+        :param callback: called as callback(transaction, previousState)
+            on every change of state, from the polling thread
+        :rtype Future:
+        :return: resolved with the transaction once in a final state
+        """
+        with self._lock:
+            watch = self._watched.get(transactionId)
+            if watch is None:
+                watch = self._watched[transactionId] = _Watch(
+                    transactionId, typ, self.minInterval)
+            if callback is not None:
+                watch.callbacks.append(callback)
+        self._wake.set()
+        return watch.future
+
+    def unwatch(self, transactionId):
+        """
+        Stop watching a transaction. Its future fails with a
+        CoinapultError, so that nobody waits for it forever.
+        """
+        with self._lock:
+            watch = self._watched.pop(transactionId, None)
+        if watch is not None and not watch.future.done():
+            err = CoinapultError('transaction %s is not watched anymore' %
+                                 transactionId)
+            watch.future.setException((CoinapultError, err, None))
+
+    def __len__(self):
+        return len(self._watched)
+
+    def feedCallback(self, payload):
+        """
+        Update a watched transaction from a verified callback payload.
+        Its next poll is postponed to maxInterval, as it is then
+        expected to be kept current by callbacks.
+        """
+        watch = self._watched.get(payload.get('transaction_id'))
+        if watch is not None:
+            self._update(watch, payload, time.time(), pushed=True)
+
+    def start(self):
+        """Poll in a background thread."""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.clear()
+            try:
+                wait = self.poll()
+            except Exception, err:
+                self.lastError = err
+                wait = self.minInterval
+            self._wake.wait(wait)
+
+    def poll(self):
+        """
+        Check the transactions that are due.
+
+        :return: seconds until the next transaction is due
+        """
+        now = time.time()
+        with self._lock:
+            due = [watch for watch in self._watched.values()
+                   if watch.nextCheck <= now]
+        byType, single = {}, []
+        for watch in due:
+            if watch.typ is None:
+                single.append(watch)
+            else:
+                byType.setdefault(watch.typ, []).append(watch)
+
+        for typ, watches in byType.items():
+            single.extend(self._pollType(typ, watches))
+
+        for watch in single[:self.maxSingle]:
+            try:
+                self.requests += 1
+                found = self.client.search(transaction_id=watch.transactionId)
+            except CoinapultError, err:
+                self.lastError = err
+                self._unchanged(watch, time.time())
+                continue
+            self._update(watch, found, time.time())
+        for watch in single[self.maxSingle:]:
+            self._unchanged(watch, now)
+
+        with self._lock:
+            if not self._watched:
+                return self.maxInterval
+            nextCheck = min(watch.nextCheck for watch in self._watched.values())
+        return max(0, nextCheck - time.time())
+
+    def _pollType(self, typ, watches):
+        """
+        Read pages of transactions of one type until every watch is
+        found. Return the watches that were not.
+        """
+        pending = dict((watch.transactionId, watch) for watch in watches)
+        timestamps = [watch.timestamp for watch in watches]
+        oldest = None if None in timestamps else min(timestamps)
+        page, pageCount = 1, 1
+        while pending and page <= min(pageCount, self.maxPages):
+            try:
+                self.requests += 1
+                resp = self.client.search(typ=typ, many=True, page=page)
+            except CoinapultError, err:
+                self.lastError = err
+                break
+            now = time.time()
+            results = resp.get('result') or []
+            for item in results:
+                watch = pending.pop(item.get('transaction_id'), None)
+                if watch is not None:
+                    self._update(watch, item, now)
+            pageCount = resp.get('pageCount') or 1
+            page += 1
+            # Pages list the newest transactions first.
+            last = results[-1].get('timestamp') if results else None
+            if oldest is not None and last is not None and last < oldest:
+                break
+        return pending.values()
+
+    def _unchanged(self, watch, now):
+        with self._lock:
+            watch.interval = min(watch.interval * 2, self.maxInterval)
+            watch.nextCheck = now + watch.interval
+
+    def _update(self, watch, transaction, now, pushed=False):
+        state = transaction.get('state')
+        with self._lock:
+            previous = watch.state
+            changed = state != previous
+            if transaction.get('type') is not None:
+                watch.typ = transaction['type']
+            if transaction.get('timestamp') is not None:
+                watch.timestamp = transaction['timestamp']
+            watch.state = state
+            if pushed:
+                watch.interval = self.maxInterval
+            elif changed:
+                watch.interval = self.minInterval
+            else:
+                watch.interval = min(watch.interval * 2, self.maxInterval)
+            watch.nextCheck = now + watch.interval
+            final = (state in self.finalStates and
+                     self._watched.get(watch.transactionId) is watch)
+            if final:
+                del self._watched[watch.transactionId]
+            callbacks = list(watch.callbacks) if changed else []
+
+        for callback in callbacks:
+            try:
+                callback(transaction, previous)
+            except Exception, err:
+                self.lastError = err
+        if final:
+            watch.future.setResult(transaction)
@@ -0,0 +1,481 @@
+"""
+Tests for the Coinapult Python client. Run from this directory with:
+
+    python -m unittest discover -p 'test_*.py'
+
+They need requests and ecdsa; the HTTP tests use coinapult_mock.
+"""
+
+import json
+import time
+import threading
+import unittest
+
+from coinapult import (CoinapultClient, AsyncCoinapultClient,
+                       CoinapultError, CoinapultTransientError,
+                       CoinapultDeadlineError, RetryPolicy, TickerCache,
+                       RequestStats, loadECDSA, iterJSONArray)
+from coinapult_mock import MockCoinapult, PAGE_SIZE, UNPROCESSED_STATUS
+
+CREDENTIALS = {'key': 'test-key', 'secret': 'test-secret'}
+
+
+class FakeSend(object):
+    """
+    Replacement for CoinapultClient.sendToCoinapult recording the sent
+    payouts, failing with the exception given for some addresses.
+    """
+
+    def __init__(self, failures=None):
+        self.failures = failures or {}
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def __call__(self, endpoint, values, sign=False, **kwargs):
+        with self._lock:
+            self.sent.append(values['address'])
+        failure = self.failures.get(values['address'])
+        if failure is not None:
+            raise failure
+        return {'transaction_id': 'tx-' + values['address'],
+                'state': 'processing'}
+
+
+class SendManyTest(unittest.TestCase):
+    payouts = [{'amount': 0.1, 'address': 'addr%d' % i} for i in range(6)]
+
+    def check(self, client):
+        fake = client.sendToCoinapult = FakeSend({
+            'addr1': ValueError('No JSON object could be decoded'),
+            'addr4': CoinapultError('insufficient funds')})
+        results = dict(client.sendMany(self.payouts, concurrency=3))
+
+        self.assertEqual(sorted(results), range(6))
+        self.assertEqual(sorted(fake.sent), sorted(
+            payout['address'] for payout in self.payouts))
+        for index in (0, 2, 3, 5):
+            self.assertEqual(results[index]['transaction_id'],
+                             'tx-addr%d' % index)
+        self.assertIsInstance(results[1], CoinapultError)
+        self.assertIn('ValueError', str(results[1]))
+        self.assertEqual(str(results[4]), 'insufficient funds')
+
+    def testFailureDoesNotAbortBatch(self):
+        self.check(CoinapultClient(credentials=CREDENTIALS))
+
+    def testAsyncClient(self):
+        client = AsyncCoinapultClient(credentials=CREDENTIALS, workers=2)
+        try:
+            self.check(client)
+        finally:
+            client.close()
+
+    def testInvalidPayoutSendsNothing(self):
+        client = CoinapultClient(credentials=CREDENTIALS)
+        fake = client.sendToCoinapult = FakeSend()
+        with self.assertRaises(CoinapultError):
+            client.sendMany(self.payouts + [{'amount': -1, 'address': 'x'}])
+        self.assertEqual(fake.sent, [])
+
+
+class IterJSONArrayTest(unittest.TestCase):
+    document = json.dumps({
+        'page': 12, 'pageCount': -3.5e2, 'ok': True, 'note': None,
+        'result': [450.01, 7, -0.5e-3, 'a "b" \\u00e9', [1, [2.25]],
+                   {'amount': 1.5, 'nested': {'x': [10, 20]}}, False, {}],
+        'text': 'x, ] }'}, indent=1)
+
+    def check(self, chunks):
+        meta = {}
+        items = list(iterJSONArray(chunks, meta=meta))
+        expected = json.loads(self.document)
+        self.assertEqual(items, expected.pop('result'))
+        self.assertEqual(meta, expected)
+
+    def testEverySplit(self):
+        for index in range(len(self.document) + 1):
+            self.check([self.document[:index], self.document[index:]])
+
+    def testSingleCharacters(self):
+        self.check(list(self.document))
+
+    def testNumberSplitAfterPoint(self):
+        self.assertEqual(list(iterJSONArray(['{"result": [450.', '01]}'])),
+                         [450.01])
+        meta = {}
+        list(iterJSONArray(['{"page": 1', '2, "result": []}'], meta=meta))
+        self.assertEqual(meta, {'page': 12})
+
+    def testErrors(self):
+        with self.assertRaises(CoinapultError) as caught:
+            list(iterJSONArray(['{"err', 'or": "busy"}']))
+        self.assertEqual(str(caught.exception), 'busy')
+        with self.assertRaises(CoinapultError):
+            list(iterJSONArray(['{"result": [1.', ']}']))
+        with self.assertRaises(CoinapultError):
+            list(iterJSONArray(['{"result": [1, 2']))
+
+
+class MockTestCase(unittest.TestCase):
+    """Runs a MockCoinapult for the tests of the class."""
+
+    mockOptions = {}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.mock = MockCoinapult(CREDENTIALS, **cls.mockOptions)
+        cls.url = cls.mock.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.mock.stop()
+
+    def client(self, cls=CoinapultClient, **kwargs):
+        client = cls(credentials=CREDENTIALS, baseURL=self.url,
+                     coinapultPub=self.mock.publicPEM, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+
+class IterSearchTest(MockTestCase):
+    count = PAGE_SIZE * 2 + 7
+
+    @classmethod
+    def setUpClass(cls):
+        super(IterSearchTest, cls).setUpClass()
+        client = CoinapultClient(credentials=CREDENTIALS, baseURL=cls.url)
+        cls.ids = set(client.receive(amount=1, currency='USD')['transaction_id']
+                      for _ in range(cls.count))
+        client.close()
+
+    def check(self, client, **kwargs):
+        found = [item['transaction_id']
+                 for item in client.iterSearch(typ='invoice', **kwargs)]
+        self.assertEqual(len(found), self.count)
+        self.assertEqual(set(found), self.ids)
+
+    def testPages(self):
+        self.check(self.client())
+        self.check(self.client(), prefetch=False)
+        self.check(self.client(), stream=True)
+
+    def testSmallChunks(self):
+        client = self.client()
+        client.streamChunkSize = 7
+        self.check(client, stream=True)
+
+    def testAsyncClient(self):
+        client = self.client(AsyncCoinapultClient, workers=2)
+        self.check(client)
+        self.check(client, stream=True)
+        meta = {}
+        items = list(client.search(typ='invoice', many=True, stream=True,
+                                   meta=meta))
+        self.assertEqual(len(items), PAGE_SIZE)
+        self.assertEqual(meta['pageCount'], 3)
+        self.assertEqual(client.search(typ='invoice', many=True).result()
+                         ['pageCount'], 3)
+
+
+class CountingFetch(object):
+    """Returns 1, 2, ... on each call, optionally waiting for release."""
+
+    def __init__(self, blocking=False):
+        self.calls = 0
+        self.release = threading.Event()
+        self.done = threading.Event()
+        if not blocking:
+            self.release.set()
+
+    def __call__(self):
+        self.calls += 1
+        self.release.wait(5)
+        self.done.set()
+        return self.calls
+
+
+class TickerCacheTest(MockTestCase):
+    def testFreshValueIsNotFetchedAgain(self):
+        client = self.client(tickerCache=TickerCache(ttl=60))
+        before = self.mock.requests
+        first, age = client.getTicker(market='USD_BTC', withAge=True)
+        self.assertEqual(age, 0.0)
+        second, age = client.getTicker(market='USD_BTC', withAge=True)
+        self.assertEqual(second, first)
+        self.assertGreater(age, 0)
+        client.getTicker(market='EUR_BTC')
+        self.assertEqual(self.mock.requests, before + 2)
+
+    def testStaleValueIsRefreshedOnce(self):
+        cache = TickerCache(ttl=0.05, staleTTL=60)
+        fetch = CountingFetch()
+        self.assertEqual(cache.get('key', fetch), (1, 0.0))
+        time.sleep(0.1)
+        fetch.release.clear()
+        fetch.done.clear()
+        # Stale values are served while a single refresh is running.
+        for _ in range(5):
+            value, age = cache.get('key', fetch)
+            self.assertEqual(value, 1)
+            self.assertGreater(age, 0.05)
+        fetch.release.set()
+        self.assertTrue(fetch.done.wait(5))
+        for _ in range(100):
+            if cache.get('key', fetch)[0] == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(cache.get('key', fetch)[0], 2)
+        self.assertEqual(fetch.calls, 2)
+
+    def testFailedRefreshKeepsStaleValue(self):
+        cache = TickerCache(ttl=0.05, staleTTL=60)
+        cache.get('key', lambda: 'old')
+
+        def failing():
+            called.set()
+            raise CoinapultError('busy')
+        called = threading.Event()
+        time.sleep(0.1)
+        self.assertEqual(cache.get('key', failing)[0], 'old')
+        self.assertTrue(called.wait(5))
+        time.sleep(0.05)
+        self.assertEqual(cache.get('key', lambda: 'new')[0], 'old')
+
+    def testExpiredValueIsFetchedBeforeReturning(self):
+        cache = TickerCache(ttl=0.01, staleTTL=0.01)
+        fetch = CountingFetch()
+        cache.get('key', fetch)
+        time.sleep(0.05)
+        self.assertEqual(cache.get('key', fetch), (2, 0.0))
+
+
+class HookTest(MockTestCase):
+    def setUp(self):
+        self.events = []
+
+    def hooked(self, **kwargs):
+        client = self.client(**kwargs)
+        client.addHook(self.events.append)
+        return client
+
+    def testEvents(self):
+        client = self.hooked()
+        client.getTicker()
+        client.receive(amount=1, currency='USD')
+        ticker, receive = self.events
+        self.assertEqual(ticker['endpoint'], '/api/ticker/')
+        self.assertIsNone(ticker['authmethod'])
+        self.assertEqual(receive['endpoint'], '/api/t/receive/')
+        self.assertEqual(receive['authmethod'], 'creds')
+        for event in self.events:
+            self.assertIsNone(event['error'])
+            self.assertEqual(sorted(event['timings']),
+                             ['parse', 'sign', 'transport'])
+            self.assertGreater(event['responseSize'], 0)
+            self.assertGreaterEqual(event['total'],
+                                    sum(event['timings'].values()) - 1e-6)
+
+    def testECCEvents(self):
+        ecdsa = loadECDSA()
+        key = ecdsa.SigningKey.generate(curve=ecdsa.SECP256k1)
+        pubkey = key.get_verifying_key().to_pem()
+        self.mock.addECCKey(pubkey)
+        client = self.hooked(ecc={'privkey': key.to_pem(), 'pubkey': pubkey},
+                             authmethod='ecc')
+        client.getBitcoinAddress()
+        event, = self.events
+        self.assertEqual(event['authmethod'], 'ecc')
+        self.assertEqual(sorted(event['timings']),
+                         ['parse', 'sign', 'transport'])
+        self.assertGreater(event['timings']['sign'], 0)
+
+    def testErrors(self):
+        client = self.hooked()
+        client.addHook(lambda event: 1 / 0)
+        with self.assertRaises(CoinapultError):
+            client.search(transaction_id='unknown')
+        event, = self.events
+        self.assertEqual(event['error'], 'CoinapultError')
+        self.assertEqual(event['endpoint'], '/api/t/search/')
+
+        client.removeHook(self.events.append)
+        client.getTicker()
+        self.assertEqual(len(self.events), 1)
+
+
+class RequestStatsTest(unittest.TestCase):
+    def event(self, total, error=None, endpoint='/api/ticker/'):
+        return {'endpoint': endpoint, 'authmethod': None, 'start': 0,
+                'total': total, 'timings': {'transport': total / 2},
+                'responseSize': 10, 'error': error}
+
+    def testHistograms(self):
+        exported = []
+        stats = RequestStats(buckets=(0.1, 0.2, 0.4), callback=exported.append)
+        for total in (0.05, 0.05, 0.15, 0.3, 1.5):
+            stats(self.event(total))
+        stats(self.event(0.05, error='CoinapultError'))
+        stats(self.event(0.05, endpoint='/api/t/send/'))
+        self.assertEqual(len(exported), 7)
+
+        ticker = stats.snapshot()['/api/ticker/']
+        self.assertEqual(ticker['count'], 6)
+        self.assertEqual(ticker['responseSize'], 60)
+        self.assertEqual(ticker['errors'], {'CoinapultError': 1})
+        total = ticker['histograms']['total']
+        self.assertEqual(total['buckets'], [3, 1, 1, 1])
+        self.assertEqual(total['max'], 1.5)
+        self.assertEqual(ticker['histograms']['transport']['count'], 6)
+
+        self.assertEqual(stats.percentile('/api/ticker/', 50), 0.1)
+        self.assertEqual(stats.percentile('/api/ticker/', 80), 0.4)
+        # The overflow bucket reports the maximum.
+        self.assertEqual(stats.percentile('/api/ticker/', 100), 1.5)
+
+        stats.reset()
+        self.assertEqual(stats.snapshot(), {})
+
+
+class RetryTest(MockTestCase):
+    def setUp(self):
+        handle = self.mock.handle
+        self.failures = []
+        self.calls = []
+
+        def failing(method, path, form, headers):
+            self.calls.append(path)
+            failure = None
+            if self.failures and path == self.failures[0][0]:
+                failure = self.failures.pop(0)[1]
+                if failure in UNPROCESSED_STATUS:
+                    return failure, {'error': 'busy'}
+            status, body = handle(method, path, form, headers)
+            if failure is not None:
+                # Processed, but the response is lost.
+                return failure, {'error': 'lost'}
+            return status, body
+        self.mock.handle = failing
+        self.addCleanup(delattr, self.mock, 'handle')
+
+    def retryClient(self, cls=CoinapultClient, **kwargs):
+        return self.client(cls, retry=RetryPolicy(3, backoff=0.01), **kwargs)
+
+    def checkFoundByExtOID(self, receive):
+        self.failures = [('/api/t/receive/', 502)]
+        invoice = receive(amount=1, currency='USD', extOID='order-retry')
+        self.assertEqual(invoice['extOID'], 'order-retry')
+        found = self.client().search(typ='invoice', extOID='order-retry',
+                                     many=True)['result']
+        self.assertEqual([item['transaction_id'] for item in found],
+                         [invoice['transaction_id']])
+
+    def testLostResponseFindsTransaction(self):
+        self.checkFoundByExtOID(self.retryClient().receive)
+
+    def testLostResponseFindsTransactionAsync(self):
+        client = self.retryClient(AsyncCoinapultClient, workers=2)
+        self.checkFoundByExtOID(
+            lambda **kwargs: client.receive(**kwargs).result(10))
+
+    def testUnprocessedIsRetried(self):
+        self.failures = [('/api/t/send/', 503)]
+        payment = self.retryClient().send(amount=0.01, address='1abc')
+        self.assertTrue(payment['extOID'])
+        self.assertEqual(self.failures, [])
+
+    def testNotResentWhenLookupFails(self):
+        client = self.retryClient()
+        # The lookup is retried too, until it gives up.
+        self.failures = [('/api/t/send/', 502)] + [('/api/t/search/', 503)] * 4
+        with self.assertRaises(CoinapultTransientError) as caught:
+            client.send(amount=0.01, address='1abc', extOID='payout-lookup')
+        self.assertIn('502', str(caught.exception))
+        self.assertEqual(self.calls.count('/api/t/send/'), 1)
+        found = self.client().search(extOID='payout-lookup')
+        self.assertEqual(found['extOID'], 'payout-lookup')
+
+    def testNotReplayedWithoutExtOID(self):
+        client = self.retryClient()
+        self.failures = [('/api/address/config', 502)]
+        with self.assertRaises(CoinapultTransientError):
+            client.configAddress('1abc')
+
+
+class DeadlineTest(MockTestCase):
+    def setUp(self):
+        handle = self.mock.handle
+        # (delay, status) of the next requests, by path.
+        self.plans = {}
+        self.calls = []
+        self.arrived = threading.Event()
+        self.lock = threading.Lock()
+
+        def delayed(method, path, form, headers):
+            with self.lock:
+                self.calls.append(path)
+                plan = self.plans.get(path)
+                delay, status = plan.pop(0) if plan else (0, None)
+            self.arrived.set()
+            time.sleep(delay)
+            if status is not None:
+                return status, {'error': 'busy'}
+            return handle(method, path, form, headers)
+        self.mock.handle = delayed
+        self.addCleanup(delattr, self.mock, 'handle')
+
+    def count(self, path):
+        with self.lock:
+            return self.calls.count(path)
+
+    def testDeadlineExceeded(self):
+        client = self.client()
+        self.plans['/api/ticker/'] = [(0.5, None)]
+        with self.assertRaises(CoinapultDeadlineError) as caught:
+            with client.deadline(0.1):
+                client.getTicker()
+        self.assertTrue(caught.exception.sent)
+        with client.deadline(5):
+            self.assertIn('index', client.getTicker())
+
+    def testHedgedReadUsesDuplicate(self):
+        client = self.client(hedgeDelay=0.05)
+        self.plans['/api/ticker/'] = [(0.3, 503)]
+        self.assertIn('index', client.getTicker())
+        self.assertEqual(self.count('/api/ticker/'), 2)
+
+    def testHedgedReadReturnsFirstResponse(self):
+        client = self.client(hedgeDelay=0.05)
+        self.plans['/api/ticker/'] = [(1.0, None)]
+        started = time.time()
+        self.assertIn('index', client.getTicker())
+        self.assertLess(time.time() - started, 0.5)
+        self.assertEqual(self.count('/api/ticker/'), 2)
+
+    def testFastReadIsNotHedged(self):
+        client = self.client(hedgeDelay=0.2)
+        client.getTicker()
+        time.sleep(0.3)
+        self.assertEqual(self.count('/api/ticker/'), 1)
+
+    def testPaymentIsNotHedged(self):
+        client = self.client(hedgeDelay=0.05)
+        self.plans['/api/t/send/'] = [(0.3, None)]
+        client.send(amount=0.01, address='1abc')
+        self.assertEqual(self.count('/api/t/send/'), 1)
+
+    def testCoalescedFollowerDeadline(self):
+        client = self.client(coalesce=True)
+        self.plans['/api/ticker/'] = [(0.5, None)]
+        leader = threading.Thread(target=client.getTicker)
+        leader.start()
+        self.addCleanup(leader.join)
+        self.assertTrue(self.arrived.wait(5))
+        with self.assertRaises(CoinapultDeadlineError) as caught:
+            with client.deadline(0.1):
+                client.getTicker()
+        self.assertTrue(caught.exception.sent)
+        self.assertEqual(self.count('/api/ticker/'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
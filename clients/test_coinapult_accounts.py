@@ -0,0 +1,129 @@
+import time
+import threading
+import unittest
+
+from coinapult import CoinapultError
+from coinapult_accounts import ClientPool
+from coinapult_mock import MockCoinapult
+
+CREDENTIALS = {'key': 'test-key', 'secret': 'test-secret'}
+
+
+class ClientPoolTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.mock = MockCoinapult(CREDENTIALS)
+        cls.url = cls.mock.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.mock.stop()
+
+    def pool(self, names=('a', 'b', 'c'), **kwargs):
+        pool = ClientPool(baseURL=self.url, **kwargs)
+        self.addCleanup(pool.close)
+        for name in names:
+            pool.register(name, credentials=CREDENTIALS)
+        return pool
+
+    def client(self, pool, name):
+        with pool.acquire(name) as client:
+            return client
+
+    def testSharedSession(self):
+        pool = self.pool()
+        self.assertIn('balances', pool.call('a', 'accountInfo'))
+        with pool.acquire('a') as first:
+            with pool.acquire('b') as second:
+                self.assertIsNot(first, second)
+                self.assertIs(first.session, pool.session)
+                self.assertIs(second.session, pool.session)
+                self.assertEqual(pool.active('a'), 1)
+        self.assertEqual(pool.active('a'), 0)
+        self.assertRaises(CoinapultError, pool.call, 'unknown', 'getTicker')
+
+    def testConcurrencyLimit(self):
+        pool = self.pool(maxConcurrent=2)
+        pool.register('vip', credentials=CREDENTIALS, maxConcurrent=3)
+        with pool.acquire('a'):
+            with pool.acquire('a'):
+                with self.assertRaises(CoinapultError):
+                    with pool.acquire('a', timeout=0.05):
+                        pass
+                # Other accounts have their own limit.
+                with pool.acquire('b', timeout=0.05):
+                    pass
+            with pool.acquire('a', timeout=0.05):
+                pass
+        with pool.acquire('vip'), pool.acquire('vip'):
+            with pool.acquire('vip', timeout=0.05):
+                pass
+
+    def testRequestsInProgressStayUnderLimit(self):
+        pool = self.pool(maxConcurrent=2)
+        handle = self.mock.handle
+        lock = threading.Lock()
+        inFlight, peak = [0], [0]
+
+        def counting(method, path, form, headers):
+            with lock:
+                inFlight[0] += 1
+                peak[0] = max(peak[0], inFlight[0])
+            try:
+                time.sleep(0.02)
+                return handle(method, path, form, headers)
+            finally:
+                with lock:
+                    inFlight[0] -= 1
+        self.mock.handle = counting
+        self.addCleanup(delattr, self.mock, 'handle')
+
+        threads = [threading.Thread(target=pool.call,
+                                    args=('a', 'accountInfo'))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(peak[0], 2)
+
+    def testLeastRecentlyUsedIsEvicted(self):
+        pool = self.pool(maxClients=2)
+        first = self.client(pool, 'a')
+        second = self.client(pool, 'b')
+        self.client(pool, 'a')
+        self.client(pool, 'c')
+        # b was used least recently.
+        self.assertEqual(len(pool), 2)
+        self.assertIsNone(second.session)
+        self.assertIs(self.client(pool, 'a'), first)
+        self.assertIsNot(self.client(pool, 'b'), second)
+        self.assertIn('b', pool)
+
+    def testIdleClientsAreEvicted(self):
+        pool = self.pool(idleTimeout=0.05)
+        client = self.client(pool, 'a')
+        with pool.acquire('b'):
+            time.sleep(0.1)
+            pool.evict()
+            # Clients in use are kept.
+            self.assertEqual(len(pool), 1)
+        self.assertIsNone(client.session)
+        self.assertIsNot(self.client(pool, 'a'), client)
+
+    def testReregisterWhileInUse(self):
+        pool = self.pool()
+        with pool.acquire('a') as old:
+            pool.register('a', credentials=CREDENTIALS, maxConcurrent=1)
+            self.assertIsNotNone(old.session)
+        self.assertIsNone(old.session)
+        with pool.acquire('a') as new:
+            self.assertIsNot(new, old)
+            self.assertRaises(CoinapultError, pool._checkout, 'a', 0.01)
+        pool.unregister('a')
+        self.assertNotIn('a', pool)
+        self.assertRaises(CoinapultError, pool.call, 'a', 'getTicker')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import json
+import base64
+import unittest
+import threading
+from StringIO import StringIO
+from urllib import urlencode
+
+from coinapult import (CoinapultClient, loadECDSA, generateHmac,
+                       generateECCsign)
+from coinapult_callback import CallbackReceiver
+
+CREDENTIALS = {'key': 'test-key', 'secret': 'test-secret'}
+
+
+class CallbackReceiverTest(unittest.TestCase):
+    def setUp(self):
+        ecdsa = loadECDSA()
+        self.serverKey = ecdsa.SigningKey.generate(curve=ecdsa.SECP256k1)
+        self.client = CoinapultClient(
+            credentials=CREDENTIALS,
+            coinapultPub=self.serverKey.get_verifying_key().to_pem())
+        self.handled = []
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def handler(self, payload):
+        with self.lock:
+            if self.failures:
+                self.failures -= 1
+                raise RuntimeError('handler failed')
+            self.handled.append(payload)
+
+    def receiver(self, **kwargs):
+        kwargs.setdefault('eccProcesses', 0)
+        receiver = CallbackReceiver(self.client, self.handler, **kwargs)
+        self.addCleanup(receiver.close)
+        return receiver
+
+    def post(self, receiver, payload, hmacSecret=None, eccKey=None):
+        data = base64.b64encode(json.dumps(payload))
+        environ = {'REQUEST_METHOD': 'POST'}
+        if eccKey is not None:
+            environ['HTTP_CPT_ECC_SIGN'] = generateECCsign(data, eccKey)
+        else:
+            environ['HTTP_CPT_KEY'] = CREDENTIALS['key']
+            environ['HTTP_CPT_HMAC'] = generateHmac(
+                data, hmacSecret or CREDENTIALS['secret'])
+        body = urlencode({'data': data})
+        environ['CONTENT_LENGTH'] = str(len(body))
+        environ['wsgi.input'] = StringIO(body)
+
+        status = []
+        receiver(environ, lambda line, headers: status.append(line))
+        return status[0]
+
+    def payload(self, state='complete'):
+        return {'transaction_id': 'tx-1', 'state': state}
+
+    def testAcceptedAndDeduplicated(self):
+        receiver = self.receiver()
+        self.assertEqual(self.post(receiver, self.payload()), '200 OK')
+        self.assertEqual(self.post(receiver, self.payload()), '200 OK')
+        receiver.close()
+        self.assertEqual(self.handled, [self.payload()])
+        self.assertEqual(receiver.stats['duplicate'], 1)
+
+    def testForgedCallbacksAreRejected(self):
+        self.checkForgedCallbacksAreRejected(self.receiver())
+
+    def testForgedCallbacksAreRejectedByWorkers(self):
+        self.checkForgedCallbacksAreRejected(self.receiver(eccProcesses=2))
+
+    def checkForgedCallbacksAreRejected(self, receiver):
+        ecdsa = loadECDSA()
+        forger = ecdsa.SigningKey.generate(curve=ecdsa.SECP256k1)
+        self.assertEqual(self.post(receiver, self.payload(), eccKey=forger),
+                         '403 Forbidden')
+        self.assertEqual(self.post(receiver, self.payload(),
+                                   hmacSecret='wrong'), '403 Forbidden')
+        self.assertEqual(self.post(receiver, self.payload(),
+                                   eccKey=self.serverKey), '200 OK')
+        receiver.close()
+        self.assertEqual(receiver.stats['rejected'], 2)
+        self.assertEqual(self.handled, [self.payload()])
+
+    def testBusy(self):
+        receiver = self.receiver(maxPending=0)
+        self.assertEqual(self.post(receiver, self.payload()),
+                         '503 Service Unavailable')
+        self.assertEqual(self.handled, [])
+
+    def testWaitForHandler(self):
+        receiver = self.receiver(waitForHandler=True)
+        self.failures = 1
+        self.assertEqual(self.post(receiver, self.payload()),
+                         '500 Internal Server Error')
+        self.assertEqual(self.handled, [])
+        # The redelivery is handled again.
+        self.assertEqual(self.post(receiver, self.payload()), '200 OK')
+        self.assertEqual(self.handled, [self.payload()])
+        self.assertEqual(receiver.stats['failed'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+from hashlib import sha256
+
+import coinapult
+from coinapult import (loadECDSA, generateECCsign, verifyECCsign,
+                       verifyCoinapultSign, rfc6979Nonce, setECCBackend,
+                       CoinapultErrorECC)
+
+try:
+    import coincurve
+except ImportError:
+    coincurve = None
+
+MESSAGES = ['', 'eyJ0aW1lc3RhbXAiOiAxfQ==', 'x' * 1000]
+
+
+class BackendTestCase(unittest.TestCase):
+    """Runs the tests of the class with the ECDSA backend named backend."""
+
+    backend = 'ecdsa'
+
+    def setUp(self):
+        previous = coinapult._eccBackend
+        self.addCleanup(setattr, coinapult, '_eccBackend', previous)
+        setECCBackend(self.backend)
+        self.ecdsa = loadECDSA()
+        self.key = self.ecdsa.SigningKey.from_secret_exponent(
+            0xc0ffee, curve=self.ecdsa.SECP256k1)
+        self.pubkey = self.key.get_verifying_key()
+
+    def expected(self, data):
+        return self.key.sign_digest_deterministic(
+            sha256(data).digest(), hashfunc=sha256,
+            sigencode=self.ecdsa.util.sigencode_string).encode('hex')
+
+    def testSignatureIsDeterministic(self):
+        for data in MESSAGES:
+            self.assertEqual(generateECCsign(data, self.key),
+                             self.expected(data))
+
+    def testVerify(self):
+        for data in MESSAGES:
+            self.assertTrue(verifyECCsign(generateECCsign(data, self.key),
+                                          data, self.pubkey))
+
+    def testTamperedSignatureIsRejected(self):
+        data = MESSAGES[1]
+        sign = generateECCsign(data, self.key).decode('hex')
+        for index in (0, 31, 32, 63):
+            tampered = (sign[:index] + chr(ord(sign[index]) ^ 1) +
+                        sign[index + 1:]).encode('hex')
+            self.assertFalse(self.verifies(tampered, data, self.pubkey))
+        self.assertFalse(self.verifies(sign[:-1].encode('hex'), data,
+                                       self.pubkey))
+        self.assertFalse(self.verifies(sign.encode('hex'), data + ' ',
+                                       self.pubkey))
+
+    def testOtherKeyIsRejected(self):
+        other = self.ecdsa.SigningKey.generate(curve=self.ecdsa.SECP256k1)
+        sign = generateECCsign(MESSAGES[1], other)
+        self.assertFalse(self.verifies(sign, MESSAGES[1], self.pubkey))
+
+    def testCachedSignatureIsNotTrustedForOtherKey(self):
+        data = MESSAGES[1]
+        sign = generateECCsign(data, self.key)
+        self.assertTrue(verifyCoinapultSign(sign, data, self.pubkey.to_pem()))
+        other = self.ecdsa.SigningKey.generate(curve=self.ecdsa.SECP256k1)
+        otherPEM = other.get_verifying_key().to_pem()
+        self.assertFalse(self.verifies(sign, data, otherPEM,
+                                       verify=verifyCoinapultSign))
+
+    def testOtherCurveIsRefused(self):
+        key = self.ecdsa.SigningKey.generate(curve=self.ecdsa.NIST256p)
+        self.assertRaises(CoinapultErrorECC, generateECCsign, 'data', key)
+
+    def verifies(self, sign, data, pubkey, verify=verifyECCsign):
+        try:
+            return verify(sign, data, pubkey)
+        except self.ecdsa.BadSignatureError:
+            return False
+
+
+@unittest.skipIf(coincurve is None, 'coincurve is not installed')
+class CoincurveBackendTest(BackendTestCase):
+    backend = 'coincurve'
+
+
+class RFC6979Test(unittest.TestCase):
+    def testSameNonceAsEcdsa(self):
+        ecdsa = loadECDSA()
+        order = ecdsa.SECP256k1.order
+        for secexp in (1, 0xc0ffee, order - 1):
+            for data in MESSAGES:
+                digest = sha256(data).digest()
+                self.assertEqual(
+                    rfc6979Nonce(secexp, digest, order),
+                    ecdsa.rfc6979.generate_k(order, secexp, sha256, digest))
+
+
+if __name__ == '__main__':
+    unittest.main()
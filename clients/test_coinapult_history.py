@@ -0,0 +1,102 @@
+import os
+import array
+import shutil
+import tempfile
+import unittest
+
+import coinapult_history
+from coinapult import CoinapultClient
+from coinapult_history import TickerSeries, HEADER, MAGIC, fetchHistory
+from coinapult_mock import MockCoinapult
+
+CREDENTIALS = {'key': 'test-key', 'secret': 'test-secret'}
+
+
+def series(points):
+    result = TickerSeries()
+    for when, bid, ask in points:
+        result._append(when, bid, ask)
+    return result
+
+
+class TickerSeriesTest(unittest.TestCase):
+    points = [(0, 1.0, 2.0), (10, 3.0, 4.0), (70, 5.0, 6.0),
+              (250, 7.0, 8.0), (290, 9.0, 10.0)]
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'usd_btc.series')
+
+    def testLookup(self):
+        data = series(self.points)
+        self.assertIsNone(data.at(-1))
+        self.assertEqual(data.at(69), (10, 3.0, 4.0))
+        self.assertEqual(list(data.slice(10, 250)), self.points[1:3])
+
+    def testResample(self):
+        data = series(self.points)
+        # Empty intervals, such as [120, 180), are skipped.
+        self.assertEqual(list(data.resample(60)),
+                         [(0, 3.0, 4.0), (60, 5.0, 6.0), (240, 9.0, 10.0)])
+        self.assertEqual(list(data.resample(60, how='mean')),
+                         [(0, 2.0, 3.0), (60, 5.0, 6.0), (240, 8.0, 9.0)])
+        self.assertRaises(ValueError, data.resample, 60, how='max')
+
+    def testFileLayout(self):
+        series(self.points).save(self.path)
+        with open(self.path, 'rb') as source:
+            content = source.read()
+        self.assertEqual(len(content), HEADER.size + 3 * 8 * 5)
+        self.assertEqual(HEADER.unpack(content[:HEADER.size]),
+                         (MAGIC, coinapult_history.VERSION, 5))
+        columns = array.array('d')
+        columns.fromstring(content[HEADER.size:])
+        self.assertEqual(list(columns),
+                         [point[i] for i in range(3) for point in self.points])
+
+    def checkLoad(self):
+        series(self.points).save(self.path)
+        self.assertEqual(list(TickerSeries.load(self.path)), self.points)
+        TickerSeries().save(self.path)
+        self.assertEqual(len(TickerSeries.load(self.path)), 0)
+
+    def testLoadWithMmap(self):
+        self.addCleanup(setattr, coinapult_history, 'numpy',
+                        coinapult_history.numpy)
+        coinapult_history.numpy = None
+        self.checkLoad()
+
+    @unittest.skipIf(coinapult_history.numpy is None,
+                     'numpy is not installed')
+    def testLoadWithNumpy(self):
+        self.checkLoad()
+
+    def testLoadRejectsOtherFiles(self):
+        with open(self.path, 'wb') as out:
+            out.write('x' * 64)
+        self.assertRaises(ValueError, TickerSeries.load, self.path)
+
+
+class FetchHistoryTest(unittest.TestCase):
+    def testChunksAreMerged(self):
+        mock = MockCoinapult(CREDENTIALS)
+        client = CoinapultClient(baseURL=mock.start())
+        self.addCleanup(mock.stop)
+        self.addCleanup(client.close)
+
+        begin = 1400000000
+        data = fetchHistory(client, begin, begin + 3 * 86400 + 600,
+                            market='USD_BTC', chunk=86400)
+        times = list(data.times)
+        self.assertEqual(times[0], begin)
+        self.assertLess(times[-1], begin + 3 * 86400 + 600)
+        self.assertEqual(times, sorted(set(times)))
+        # Every chunk was requested: the last one holds 600 seconds.
+        self.assertGreater(times[-1], begin + 3 * 86400)
+        self.assertEqual(len(data.bids), len(times))
+        self.assertEqual(len(fetchHistory(client, begin, begin)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+from coinapult import CoinapultClient, CoinapultError
+from coinapult_mock import MockCoinapult
+from coinapult_mirror import TransactionMirror
+
+CREDENTIALS = {'key': 'test-key', 'secret': 'test-secret'}
+
+
+class TransactionMirrorTest(unittest.TestCase):
+    def setUp(self):
+        self.mock = MockCoinapult(CREDENTIALS)
+        self.client = CoinapultClient(credentials=CREDENTIALS,
+                                      baseURL=self.mock.start())
+        self.addCleanup(self.mock.stop)
+        self.addCleanup(self.client.close)
+        self.mirror = TransactionMirror(self.client)
+        self.addCleanup(self.mirror.close)
+        self.invoices = [self.client.receive(amount=1, currency='USD',
+                                             extOID='order-%d' % i)
+                         for i in range(3)]
+
+    def testSync(self):
+        self.assertEqual(self.mirror.sync(typ='invoice'), 3)
+        found = self.mirror.search(extOID='order-1')
+        self.assertEqual(found['transaction_id'],
+                         self.invoices[1]['transaction_id'])
+        self.assertEqual(len(self.mirror.search(many=True, state='processing')),
+                         3)
+
+    def testRemoteFallback(self):
+        found = self.mirror.search(extOID='order-2')
+        self.assertEqual(found['transaction_id'],
+                         self.invoices[2]['transaction_id'])
+        self.assertEqual(len(self.mirror.search(refresh=True, many=True,
+                                                currency='USD')), 3)
+
+    def testRefreshByStateOnly(self):
+        with self.assertRaises(CoinapultError) as caught:
+            self.mirror.search(refresh=True, many=True, state='complete')
+        self.assertIn('state', str(caught.exception))
+        self.assertEqual(self.mirror.search(refresh=True, many=True,
+                                            typ='invoice', state='complete'),
+                         [])
+
+
+    def testRemoteSingleSearchChecksState(self):
+        with self.assertRaises(CoinapultError):
+            self.mirror.search(extOID='order-1', state='complete')
+        found = self.mirror.search(refresh=True, extOID='order-1',
+                                   state='processing')
+        self.assertEqual(found['transaction_id'],
+                         self.invoices[1]['transaction_id'])
+        with self.assertRaises(CoinapultError):
+            self.mirror.search(refresh=True, extOID='order-1',
+                               state='complete')
+
+
+if __name__ == '__main__':
+    unittest.main()
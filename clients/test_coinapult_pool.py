@@ -0,0 +1,105 @@
+import json
+import shutil
+import os.path
+import tempfile
+import unittest
+
+from coinapult import CoinapultError
+from coinapult_pool import PaymentPool
+
+
+class FakeClient(object):
+    """Hands out numbered addresses; configAddress fails when told to."""
+
+    def __init__(self):
+        self.created = 0
+        self.configured = []
+        self.failure = None
+
+    def getBitcoinAddress(self):
+        self.created += 1
+        return {'address': 'addr%d' % self.created}
+
+    def configAddress(self, address, **kwargs):
+        if self.failure is not None:
+            raise self.failure
+        self.configured.append((address, kwargs))
+        return {'address': address}
+
+
+class PaymentPoolTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'pool.json')
+        self.client = FakeClient()
+
+    def pool(self):
+        pool = PaymentPool(self.client, path=self.path)
+        pool.addAddresses('btc', low=2, high=3)
+        return pool
+
+    def saved(self):
+        with open(self.path) as source:
+            return json.load(source)
+
+    def testClaimIsLoggedBeforeReturning(self):
+        pool = self.pool()
+        self.assertEqual(pool.refill(), 3)
+        pool.save()
+        before = self.saved()
+        address = pool.claim('btc', extOID='order-1')['address']
+        # The claim only goes to the log, the saved pool is left as is.
+        self.assertEqual(self.saved(), before)
+        restarted = self.pool()
+        self.assertEqual(restarted.available('btc'), 2)
+        self.assertEqual(restarted.bindings[address]['extOID'], 'order-1')
+        # A restart does not hand the address out again.
+        self.assertNotEqual(restarted.claim('btc')['address'], address)
+
+    def testSaveCompactsLog(self):
+        pool = self.pool()
+        pool.refill()
+        pool.save()
+        address = pool.claim('btc', extOID='order-1')['address']
+        pool.save()
+        self.assertEqual(os.path.getsize(self.path + '.log'), 0)
+        self.assertFalse(os.path.exists(self.path + '.log.old'))
+        state = self.saved()
+        self.assertEqual(len(state['items']['btc']), 2)
+        self.assertNotIn({'address': address}, state['items']['btc'])
+        self.assertEqual(state['bindings'][address]['extOID'], 'order-1')
+
+    def testTornLogLineIsIgnored(self):
+        pool = self.pool()
+        pool.refill()
+        pool.save()
+        address = pool.claim('btc', extOID='order-1')['address']
+        with open(self.path + '.log', 'a') as log:
+            log.write('{"name": "btc", "ke')
+        restarted = self.pool()
+        self.assertEqual(restarted.available('btc'), 2)
+        self.assertIn(address, restarted.bindings)
+        # Claims after the torn line are still replayed.
+        second = restarted.claim('btc')['address']
+        self.assertIn(second, self.pool().bindings)
+
+    def testFailedConfigKeepsAddress(self):
+        pool = self.pool()
+        pool.refill()
+        pool.save()
+        first = self.saved()['items']['btc'][0]
+        self.client.failure = CoinapultError('busy')
+        with self.assertRaises(CoinapultError):
+            pool.claim('btc', extOID='order-1')
+        self.assertEqual(pool.available('btc'), 3)
+        self.assertEqual(pool.bindings, {})
+        self.assertEqual(self.pool().available('btc'), 3)
+
+        self.client.failure = None
+        self.assertEqual(pool.claim('btc', extOID='order-1'), first)
+        self.assertEqual(self.client.configured,
+                         [(first['address'], {'extOID': 'order-1'})])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+from decimal import Decimal, ROUND_DOWN
+
+from coinapult import CoinapultClient, CoinapultError
+from coinapult_mock import MockCoinapult, RATES, SPREAD
+from coinapult_pricing import (PricingError, convertPrices, snapshotRates,
+                               validateAmountsBatch)
+
+CREDENTIALS = {'key': 'test-key', 'secret': 'test-secret'}
+
+
+class ConvertPricesTest(unittest.TestCase):
+    rates = {'USD': Decimal('450'), 'EUR': 330.0, 'BTC': Decimal(1)}
+
+    def testRounding(self):
+        prices = convertPrices(['1', 0.1, Decimal('4.5')], 'USD', self.rates,
+                               places=4)
+        self.assertEqual(prices, [Decimal('0.0022'), Decimal('0.0002'),
+                                  Decimal('0.0100')])
+        # 0.0225 / 450 is exactly 0.00005, rounded up unless asked.
+        self.assertEqual(convertPrices(['0.0225'], 'USD', self.rates,
+                                       places=4),
+                         [Decimal('0.0001')])
+        self.assertEqual(convertPrices(['0.0225'], 'USD', self.rates,
+                                       places=4, rounding=ROUND_DOWN),
+                         [Decimal('0.0000')])
+
+    def testFloatsKeepTheirShortestRepresentation(self):
+        # Decimal(0.1) would be 0.1000000000000000055511151231257827...
+        self.assertEqual(validateAmountsBatch([0.1]), [Decimal('0.1')])
+        self.assertEqual(convertPrices([33.0], ['EUR'], self.rates),
+                         [Decimal('0.10000000')])
+
+    def testPerRowCurrencies(self):
+        self.assertEqual(
+            convertPrices([450, 330, '0.5'], ['USD', 'EUR', 'BTC'],
+                          self.rates),
+            [Decimal('1.00000000'), Decimal('1.00000000'),
+             Decimal('0.50000000')])
+
+    def testEveryBadRowIsReported(self):
+        with self.assertRaises(PricingError) as caught:
+            convertPrices(['1', 'abc', -2, '0', 'NaN', 5, None],
+                          ['USD', 'USD', 'USD', 'USD', 'USD', 'JPY', 'USD'],
+                          self.rates)
+        self.assertEqual(caught.exception.errors, [
+            (1, 'amount must be a number'),
+            (2, 'amount must be positive'),
+            (3, 'amount must be positive'),
+            (4, 'amount must be a number'),
+            (5, 'no rate for JPY'),
+            (6, 'amount must be a number')])
+        self.assertIn('6 invalid rows', str(caught.exception))
+
+    def testCurrencyCountMustMatch(self):
+        self.assertRaises(CoinapultError, convertPrices, [1, 2], ['USD'],
+                          self.rates)
+
+
+class SnapshotRatesTest(unittest.TestCase):
+    def testRatesFromTicker(self):
+        mock = MockCoinapult(CREDENTIALS)
+        client = CoinapultClient(baseURL=mock.start())
+        self.addCleanup(mock.stop)
+        self.addCleanup(client.close)
+
+        rates = snapshotRates(client, ['USD', 'EUR', 'BTC'])
+        self.assertEqual(rates, {'USD': Decimal(str(RATES['USD'])),
+                                 'EUR': Decimal(str(RATES['EUR'])),
+                                 'BTC': Decimal(1)})
+        bids = snapshotRates(client, ['USD'], tier='small')
+        self.assertEqual(bids['USD'],
+                         Decimal(str(RATES['USD'] * (1 - SPREAD))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import time
+import unittest
+
+from coinapult_mock import MockCoinapult, STREAM_PATH
+from coinapult_stream import TickerStream
+
+
+class TickerStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.mock = MockCoinapult(streamInterval=0.05)
+        self.url = self.mock.start() + STREAM_PATH
+        self.addCleanup(self.mock.stop)
+
+    def stream(self, **kwargs):
+        stream = TickerStream(self.url, timeout=(1, 5), reconnectDelay=0.05,
+                              **kwargs)
+        stream.start()
+        self.addCleanup(stream.stop, 1)
+        return stream
+
+    def waitFor(self, condition, timeout=5):
+        deadline = time.time() + timeout
+        while not condition():
+            if time.time() > deadline:
+                self.fail("timed out")
+            time.sleep(0.01)
+
+    def testRates(self):
+        stream = self.stream(markets=['USD_BTC', 'EUR_BTC'])
+        queue = stream.subscribe()
+        self.waitFor(lambda: len(stream.rates) == 2)
+        self.assertEqual(stream.latest('EUR_BTC')['market'], 'EUR_BTC')
+        self.assertIn(queue.get(timeout=1)['market'], ('USD_BTC', 'EUR_BTC'))
+
+    def testMalformedMessagesAreSkipped(self):
+        self.mock.streamPrefix = ['[1, 2]', '"text"']
+        stream = self.stream(markets=['USD_BTC'])
+        self.waitFor(lambda: stream.latest('USD_BTC') is not None)
+        self.assertEqual(stream.connects, 1)
+        self.assertIn('unexpected message', str(stream.lastError))
+
+    def testInvalidJSONReconnects(self):
+        self.mock.streamPrefix = ['{not json']
+        stream = self.stream(markets=['USD_BTC'])
+        self.waitFor(lambda: stream.connects >= 2)
+        self.assertIsInstance(stream.lastError, ValueError)
+        self.assertTrue(stream._thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+
+from coinapult import CoinapultError
+from coinapult_watcher import TransactionWatcher
+
+
+class FakeClient(object):
+    """Answers searches from a dict of states by transaction_id."""
+
+    def __init__(self, states):
+        self.states = states
+
+    def search(self, transaction_id=None, many=False, **kwargs):
+        if many:
+            return {'result': [self.transaction(transactionId)
+                               for transactionId in sorted(self.states)],
+                    'pageCount': 1}
+        return self.transaction(transaction_id)
+
+    def transaction(self, transactionId):
+        return {'transaction_id': transactionId, 'type': 'invoice',
+                'state': self.states[transactionId]}
+
+
+class TransactionWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeClient({'tx-1': 'pending', 'tx-2': 'pending'})
+        self.watcher = TransactionWatcher(self.client, minInterval=0)
+
+    def testFinalState(self):
+        future = self.watcher.watch('tx-1')
+        self.watcher.poll()
+        self.assertFalse(future.done())
+        self.client.states['tx-1'] = 'complete'
+        self.watcher.poll()
+        self.assertEqual(future.result(1)['state'], 'complete')
+        self.assertEqual(len(self.watcher), 0)
+
+    def testUnwatchFailsFuture(self):
+        future = self.watcher.watch('tx-1')
+        other = self.watcher.watch('tx-2')
+        self.watcher.unwatch('tx-1')
+        self.assertIsInstance(future.exception(1), CoinapultError)
+        self.assertRaises(CoinapultError, future.result, 1)
+        self.assertFalse(other.done())
+        self.assertEqual(len(self.watcher), 1)
+        # Unwatching again, or an unknown transaction, does nothing.
+        self.watcher.unwatch('tx-1')
+        self.watcher.unwatch('tx-3')
+
+
+if __name__ == '__main__':
+    unittest.main()